@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+逐張 vs 批次情緒推論吞吐量（CPU）。
+
+用法：
+    python benchmarks/bench_emotion_batch.py [--image 照片路徑] [--frames 32] [--batch 8]
+
+未指定 --image 時使用隨機雜訊影格（沒有人臉，只量測推論本身的成本）。
+建議加上 CUDA_VISIBLE_DEVICES=-1 以確保在 CPU 上量測。
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "servers"))
+import emotion_detection_mcp as edm  # noqa: E402
+
+
+def _frames(image_path, count):
+    if image_path:
+        frame = cv2.imread(image_path)
+        if frame is None:
+            raise SystemExit(f"無法讀取影像：{image_path}")
+        return [frame.copy() for _ in range(count)]
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="含人臉的測試照片（可省略）")
+    parser.add_argument("--frames", type=int, default=32)
+    parser.add_argument("--batch", type=int, default=8)
+    args = parser.parse_args()
+
+    frames = _frames(args.image, args.frames)
+
+    # 暖機：兩條路徑都先各跑一次，避免把建圖/載入權重算進去
+    edm.analyze_emotion(frames[0])
+    edm.analyze_emotions_batch(frames[:2])
+
+    per_frame = _timed(lambda: [edm.analyze_emotion(f) for f in frames])
+    batched = _timed(lambda: [
+        edm.analyze_emotions_batch(frames[i:i + args.batch]) for i in range(0, len(frames), args.batch)
+    ])
+
+    print(f"frames={len(frames)} batch={args.batch} batch_path={'off' if edm._batch_disabled else 'on'}")
+    print(f"per-frame : {per_frame:.3f}s  {len(frames) / per_frame:.1f} fps")
+    print(f"batched   : {batched:.3f}s  {len(frames) / batched:.1f} fps")
+    print(f"speedup   : {per_frame / batched:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
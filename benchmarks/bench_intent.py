@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+意圖判斷的回歸檢查與微基準：IntentEngine vs 舊版逐條 regex。
+
+用法：
+    python benchmarks/bench_intent.py [--repeat 2000]
+
+1) 以 benchmarks/intent_corpus.jsonl（實際使用者語句與預期的 intent / slot / 選單捷徑）檢查
+   python_agent.detect_intent、parse_music_query 與選單關鍵字；有不符就列出並以 exit 1 結束。
+2) 對同一批語句量測每則訊息的平均耗時（舊版：逐條 re.search + 三段 parse_music_query + 選單子字串）。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "python-agent"))
+import python_agent as pa  # noqa: E402
+
+CORPUS_PATH = os.path.join(HERE, "intent_corpus.jsonl")
+
+# ---- 舊版實作（基準） ----
+LEGACY_PATTERNS = {
+    "music": [r"(想|要|可以)?(聽|播|播放).*?(歌|音樂)", r"(來|放)一?首", r"音樂.*(放|播)"],
+    "game": [r"(想|要|可以)?(玩|來).*?(遊戲|小遊戲)", r"紓壓.*(遊戲)"],
+    "mind": [r"(想|要|可以)?.*?(正念|冥想|呼吸練習|身體掃描|放鬆練習)"],
+}
+
+
+def legacy_parse_music_query(text):
+    m = re.search(
+        r"(聽|播|播放|來|放).*?(?P<q>周杰倫|五月天|lo-?fi|lofi|鋼琴|放鬆|輕音樂|抒情|搖滾|爵士|古典|電音|hip[- ]?hop|rap|白噪音|日文|韓文|英文|中文|中文歌|日語|韓語)",
+        text, re.I
+    )
+    if m:
+        return m.group("q").strip()
+    m = re.search(r"想.*?聽(?P<q>.+?)(的歌)?$", text, re.I)
+    if m:
+        return m.group("q").strip()
+    m = re.search(r"(來|放).*?一?首(?P<q>.+)$", text, re.I)
+    if m:
+        return m.group("q").strip()
+    return ""
+
+
+def legacy_detect_intent(text):
+    t = text.strip().lower()
+    if t.startswith(("/music", "/game", "/mind", "/menu", "/end", "/reset")):
+        return None
+    for intent, pats in LEGACY_PATTERNS.items():
+        for pat in pats:
+            if re.search(pat, text, re.I):
+                if intent == "music":
+                    return ("music", legacy_parse_music_query(text))
+                return (intent, None)
+    return None
+
+
+def legacy_menu(raw):
+    if "玩紓壓" in raw:
+        return "game"
+    if "正念" in raw or "冥想" in raw:
+        return "mind"
+    if "聊天" in raw:
+        return "chat"
+    return None
+
+
+def engine_menu(raw):
+    return (pa.INTENTS.match(raw, "menu") or (None,))[0]
+
+
+def check(corpus):
+    failures = 0
+    for case in corpus:
+        text = case["text"]
+        got = pa.detect_intent(text)
+        got = list(got) if got else None
+        expected = [case["intent"], case["slot"]] if case["intent"] else None
+        problems = []
+        if got != expected:
+            problems.append(f"detect_intent={got} expected={expected}")
+        if engine_menu(text) != case["menu"]:
+            problems.append(f"menu={engine_menu(text)} expected={case['menu']}")
+        if case["intent"] == "music" and pa.parse_music_query(text) != case["slot"]:
+            problems.append(f"parse_music_query={pa.parse_music_query(text)!r}")
+        if problems:
+            failures += 1
+            print(f"FAIL {text!r}: " + "; ".join(problems))
+    return failures
+
+
+def _per_message_us(fn, texts, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - started) / (repeat * len(texts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, "r", encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    failures = check(corpus)
+    print(f"corpus: {len(corpus)} utterances, {failures} failures")
+
+    texts = [case["text"] for case in corpus]
+    # 選單模式的關鍵字捷徑 + 聊天模式的意圖判斷（兩種模式的判斷合計）
+    legacy = _per_message_us(lambda t: (legacy_menu(t), legacy_detect_intent(t)), texts, args.repeat)
+    engine = _per_message_us(lambda t: (engine_menu(t), pa.detect_intent(t)), texts, args.repeat)
+    print(f"legacy regex : {legacy:6.2f} us/message")
+    print(f"IntentEngine : {engine:6.2f} us/message")
+    print(f"speedup      : {legacy / engine:.2f}x")
+
+    # 依預期意圖分組：沒有意圖的一般聊天訊息只需一次合併 regex 掃描
+    groups = {}
+    for case in corpus:
+        groups.setdefault(case["intent"] or "(none)", []).append(case["text"])
+    for name, group in sorted(groups.items()):
+        old = _per_message_us(legacy_detect_intent, group, args.repeat)
+        new = _per_message_us(pa.detect_intent, group, args.repeat)
+        print(f"  detect_intent {name:<7} n={len(group):<3} legacy {old:6.2f} us  engine {new:6.2f} us")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
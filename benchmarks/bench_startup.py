@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+各 Python 進入點的啟動時間：import 成本（python -X importtime）與到第一個回應的時間。
+
+用法：
+    python benchmarks/bench_startup.py [--runs 3] [--only agent,emotion,legacy] [--top 8]
+
+量測項目：
+    agent    python-agent/python_agent.py：模組 import 時間，以及背景載入 huggingface_hub 的時間
+    emotion  servers/emotion_detection_mcp.py：啟動伺服器到 MCP list_tools 回應（port 8001）
+    legacy   emotion_detect_mcp_server-main/main.py：啟動伺服器到 GET /manifest 回應（port 8010）
+
+每個項目另外列出 -X importtime 中累計最久的幾個模組，方便確認重量級模組沒有在啟動時載入。
+伺服器量測需要對應的 port 沒被占用；攝影機不會被開啟（只呼叫不碰攝影機的請求）。
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+AGENT_DIR = os.path.join(ROOT, "python-agent")
+SERVERS_DIR = os.path.join(ROOT, "servers")
+LEGACY_DIR = os.path.join(SERVERS_DIR, "emotion_detect_mcp_server-main", "emotion_detect_mcp_server-main")
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(module: str, cwd: str, top: int):
+    """以 -X importtime 匯入模組，回傳 (總秒數, 它直接 import 的模組中累計最久的 [(名稱, 秒)])。"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=cwd, capture_output=True, text=True, timeout=600)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    total, children = 0.0, []
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_LINE.match(line)
+        if not m:
+            continue
+        # 名稱前的縮排：1 格 = 頂層（-c 直接 import 的），3 格 = 它 import 的模組；累計時間含子模組
+        depth, name, sec = len(m.group(3)), m.group(4), int(m.group(2)) / 1e6
+        if depth == 1 and name == module:
+            total = sec
+        elif depth == 3:
+            children.append((name, sec))
+    return total, sorted(children, key=lambda kv: kv[1], reverse=True)[:top]
+
+
+def agent_first_ready() -> float:
+    """新行程中 import python_agent 並建好 Agent 類別（第一次建 Agent 前必經）的秒數。"""
+    code = ("import time; t=time.perf_counter(); import python_agent as pa; "
+            "pa._fast_boot_agent_class(); print(time.perf_counter()-t)")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=AGENT_DIR, capture_output=True, text=True, timeout=600)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+async def _poll(probe, proc, timeout: float) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"伺服器提早結束（exit {proc.returncode}）")
+        try:
+            await probe()
+            return time.perf_counter() - started
+        except ImportError:
+            raise  # 缺少 client 套件時重試也沒用
+        except Exception:
+            await asyncio.sleep(0.05)
+    raise TimeoutError("等待第一個回應逾時")
+
+
+async def _mcp_list_tools():
+    # 用 fastmcp 的 Client：mcp 套件的 streamable-http client 函式名稱在各版本間不一致
+    from fastmcp import Client
+
+    async with Client("http://127.0.0.1:8001/mcp") as client:
+        await client.list_tools()
+
+
+async def _legacy_manifest():
+    import httpx
+
+    async with httpx.AsyncClient(timeout=1.0) as client:
+        (await client.get("http://127.0.0.1:8010/manifest")).raise_for_status()
+
+
+def server_first_response(cmd, cwd, probe, timeout=300.0) -> float:
+    """啟動伺服器行程，量測到 probe 第一次成功的秒數（包含直譯器啟動與 import）。"""
+    env = dict(os.environ, EMOTION_MONITOR="0")
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        return asyncio.run(_poll(probe, proc, timeout))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+TARGETS = {
+    "agent": {
+        "module": ("python_agent", AGENT_DIR),
+        "first": agent_first_ready,
+        "label": "import + Agent class",
+    },
+    "emotion": {
+        "module": ("emotion_detection_mcp", SERVERS_DIR),
+        "first": lambda: server_first_response([sys.executable, "emotion_detection_mcp.py"], SERVERS_DIR,
+                                               _mcp_list_tools),
+        "label": "spawn -> list_tools",
+    },
+    "legacy": {
+        "module": ("main", LEGACY_DIR),
+        "first": lambda: server_first_response([sys.executable, "main.py"], LEGACY_DIR, _legacy_manifest),
+        "label": "spawn -> /manifest",
+    },
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--only", default=",".join(TARGETS))
+    parser.add_argument("--top", type=int, default=8, help="列出累計 import 時間最久的前幾個模組")
+    args = parser.parse_args()
+
+    for name in [n.strip() for n in args.only.split(",") if n.strip()]:
+        target = TARGETS[name]
+        module, cwd = target["module"]
+        print(f"== {name} ==")
+        try:
+            total, heaviest = import_profile(module, cwd, args.top)
+            print(f"import {module:<24}: {total:.3f}s")
+            for mod, sec in heaviest:
+                print(f"    {mod:<30} {sec:.3f}s")
+            samples = [target["first"]() for _ in range(args.runs)]
+            print(f"{target['label']:<31}: median {statistics.median(samples):.3f}s  "
+                  f"min {min(samples):.3f}s  max {max(samples):.3f}s  (runs={len(samples)})")
+        except Exception as e:
+            print(f"  skipped: {e}")
+
+
+if __name__ == "__main__":
+    main()
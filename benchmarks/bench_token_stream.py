@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+逐 token 寫出 vs TokenStreamWriter 合併寫出：stdout 系統呼叫次數與 GUI 端（讀取管線的行程）CPU。
+
+用法：
+    python benchmarks/bench_token_stream.py [--tokens 3000] [--delay-ms 2] [--qt]
+
+子行程用 python_agent.TokenStreamWriter 輸出一段合成的 token 串流（中英混合、偶爾換行），
+統計實際寫入管線的次數；父行程扮演 GUI：每次管線可讀就讀出一塊並「渲染」，
+統計被喚醒次數與 CPU 時間。--qt 時用 QTextDocument 插入文字當作渲染成本（需要 PySide6），
+否則只做解碼與字串串接。
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# 子行程：以計數的 raw writer 包住 stdout，跑完把寫入次數印到 stderr
+_CHILD = r"""
+import io, os, sys, asyncio, random
+sys.path.insert(0, os.path.join({root!r}, "python-agent"))
+import python_agent as pa
+
+class CountingRaw(io.RawIOBase):
+    writes = 0
+    def writable(self):
+        return True
+    def write(self, b):
+        CountingRaw.writes += 1
+        return os.write(1, b)
+
+out = io.TextIOWrapper(io.BufferedWriter(CountingRaw(), 1 << 16), encoding="utf-8")
+rng = random.Random(0)
+words = ["我", "們", "今天", "感覺", "如何", "？", "放鬆", "一下", " the", " music", " is", " calm", "。", "，"]
+
+async def main():
+    writer = pa.TokenStreamWriter(out, window_sec={window}, max_chars={chars})
+    for i in range({tokens}):
+        writer.write(rng.choice(words) + ("\n" if rng.random() < 0.02 else ""))
+        await asyncio.sleep({delay})
+    writer.flush()
+
+asyncio.run(main())
+out.write("\n")
+out.flush()
+print(CountingRaw.writes, file=sys.stderr)
+"""
+
+
+def _renderer(use_qt):
+    if not use_qt:
+        parts = []
+        return lambda chunk: parts.append(chunk.decode("utf-8", "replace"))
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtGui import QGuiApplication, QTextDocument, QTextCursor
+
+    _renderer.app = QGuiApplication.instance() or QGuiApplication([])
+    doc = QTextDocument()
+    cursor = QTextCursor(doc)
+
+    def render(chunk):
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(chunk.decode("utf-8", "replace"))
+        doc.size()  # 觸發版面計算，近似一次重繪前的排版成本
+    return render
+
+
+def run(label, window_sec, max_chars, args):
+    code = _CHILD.format(root=ROOT, window=window_sec, chars=max_chars, tokens=args.tokens,
+                         delay=args.delay_ms / 1000.0)
+    render = _renderer(args.qt)
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    wakeups = 0
+    fd = proc.stdout.fileno()
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        wakeups += 1
+        render(chunk)
+    proc.wait()
+    elapsed = time.perf_counter() - started
+    gui_cpu = time.process_time() - started_cpu
+    err = proc.stderr.read().decode("utf-8", "replace").strip().splitlines()
+    writes = err[-1] if err else "?"
+    print(f"{label:<10} writes={writes:>6}  gui_wakeups={wakeups:>6}  gui_cpu={gui_cpu * 1000:8.1f}ms  "
+          f"wall={elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=3000)
+    parser.add_argument("--delay-ms", type=float, default=2.0, help="token 之間的間隔（模擬模型生成速度）")
+    parser.add_argument("--window-ms", type=float, default=50.0)
+    parser.add_argument("--chars", type=int, default=256)
+    parser.add_argument("--qt", action="store_true", help="用 QTextDocument 量測渲染成本")
+    args = parser.parse_args()
+
+    print(f"tokens={args.tokens} delay={args.delay_ms}ms render={'qt' if args.qt else 'str'}")
+    run("per-token", 0.0, 1, args)
+    run("coalesced", args.window_ms / 1000.0, args.chars, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 import sys
-import subprocess
-import threading
 import os
+import json
+import time
+import codecs
+from collections import deque
 from PySide6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QTextEdit, QPushButton, QLineEdit, QLabel,
-    QHBoxLayout, QFrame, QGraphicsDropShadowEffect, QGridLayout
+    QApplication, QWidget, QVBoxLayout, QPlainTextEdit, QPushButton, QLineEdit, QLabel,
+    QHBoxLayout, QFrame, QGraphicsDropShadowEffect, QGridLayout, QMessageBox
 )
-from PySide6.QtGui import QFont, QIcon
-from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QFont, QIcon, QColor, QTextCharFormat, QTextCursor
+from PySide6.QtCore import Qt, Signal, QTimer, QProcess, QProcessEnvironment
+
+# Log 區設定（可用環境變數覆寫）
+LOG_MAX_LINES = max(100, int(os.environ.get("GUI_LOG_MAX_LINES", "5000")))  # 超過就丟掉最舊的行
+LOG_FLUSH_MS = max(10, int(os.environ.get("GUI_LOG_FLUSH_MS", "50")))      # 排隊中的行每隔多久批次畫上去
+LOG_COLORS = {
+    "user": "#00c2a8",    # 主色
+    "stdout": "#8ab4ff",  # 輸出藍
+    "system": "#f2b86b",  # GUI 自己的狀態訊息（子程式結束、重新啟動）
+    "menu": "#c3e88d",    # 功能選單
+    "emotion": "#ff8a80", # 情緒偵測提醒
+    "status": "#6b7689",  # 工具狀態、量測（淡色）
+}
+# 與 python_agent 的通訊格式：jsonl = 帶型別的 JSON frame（見 python_agent.py「輸出通道」）；text = 純文字行
+AGENT_IPC = os.environ.get("GUI_AGENT_IPC", "jsonl").strip().lower()
+STATUS_MIN_INTERVAL_SEC = float(os.environ.get("GUI_STATUS_MIN_MS", "1000")) / 1000.0  # tool_status/metrics 節流
+STDERR_TAIL_LINES = 8  # 子程式異常結束時，在對話框中附上最後幾行 stderr
 
 
 class PythonAppGUI(QWidget):
@@ -17,6 +35,11 @@ class PythonAppGUI(QWidget):
         super().__init__()
         self.python_app_path = python_app_path
         self.proc = None
+        self._stopping = False
+        self._streams = {}  # stdout/stderr -> [增量 UTF-8 解碼器, 尚未換行的殘段]
+        self._stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        self._status_shown_at = {}  # frame type -> 上次顯示時間（節流用）
+        self._line_open = False     # 最後一行是否為還在串流中的助理回覆
         self.add_log_signal.connect(self.add_log)
 
         # ── Window ────────────────────────────────────────────────────────────────
@@ -45,13 +68,13 @@ class PythonAppGUI(QWidget):
                 border: 1px solid #262c36;
                 border-radius: 14px;
             }
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #0f1115;
                 border: 1px solid #262c36;
                 border-radius: 10px;
                 padding: 12px;
                 font-family: "Cascadia Code", "JetBrains Mono", "Consolas", "Noto Sans Mono CJK TC", monospace;
-                font-size: 16px;
+                font-size: 15px;
             }
             QLineEdit {
                 background-color: #0f1115;
@@ -158,15 +181,23 @@ class PythonAppGUI(QWidget):
         shadow.setColor(Qt.black)
         log_card.setGraphicsEffect(shadow)
 
-        # Log 輸出區
-        self.log_output = QTextEdit()
+        # Log 輸出區：純文字元件 + 每行字色，超過 LOG_MAX_LINES 行自動丟掉最舊的
+        self.log_output = QPlainTextEdit()
         self.log_output.setReadOnly(True)
-        self.log_output.setLineWrapMode(QTextEdit.WidgetWidth)
-        # 提前插入一段 style（僅作為視覺初始化，不影響後續 append）
-        self.log_output.append(
-            '<div style="font-family:\'Cascadia Code\',\'JetBrains Mono\',Consolas,monospace; '
-            'font-size:14.5px; line-height:1.5;"></div>'
-        )
+        self.log_output.setUndoRedoEnabled(False)
+        self.log_output.setLineWrapMode(QPlainTextEdit.WidgetWidth)
+        self.log_output.setMaximumBlockCount(LOG_MAX_LINES)
+        self._log_formats = {}
+        for log_type, color in LOG_COLORS.items():
+            fmt = QTextCharFormat()
+            fmt.setForeground(QColor(color))
+            self._log_formats[log_type] = fmt
+        # 收到的行先排隊，由計時器批次繪製（一批只重排版、捲動一次）
+        self._log_queue = deque(maxlen=LOG_MAX_LINES)
+        self._log_timer = QTimer(self)
+        self._log_timer.setInterval(LOG_FLUSH_MS)
+        self._log_timer.timeout.connect(self.flush_log)
+        self._log_timer.start()
         log_layout.addWidget(self.log_output)
         root.addWidget(log_card, 2)
 
@@ -200,8 +231,8 @@ class PythonAppGUI(QWidget):
 
         root.addWidget(input_card)
 
-        # ── 啟動子程式（保持原始邏輯） ────────────────────────────────────────
-        threading.Thread(target=self.start_python_app, daemon=True).start()
+        # ── 啟動子程式（QProcess：I/O 由 Qt 事件迴圈驅動，不另開讀取執行緒） ──
+        QTimer.singleShot(0, self.start_python_app)
 
     # ── 行為邏輯（未更動核心流程，只調整按鈕樣式切換） ────────────────────────
     def toggle_auto_detect(self):
@@ -217,63 +248,170 @@ class PythonAppGUI(QWidget):
         self.btn_auto_detect.style().polish(self.btn_auto_detect)
 
     def start_python_app(self):
-        if self.proc and self.proc.poll() is None:
+        if self.proc is not None and self.proc.state() != QProcess.NotRunning:
             self.add_log_signal.emit("⚠️ Python App already running.", "stderr")
             return
-
-        self.proc = subprocess.Popen(
-            [sys.executable, self.python_app_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-
-        threading.Thread(target=self.read_stream, args=(self.proc.stdout, "stdout"), daemon=True).start()
-        threading.Thread(target=self.read_stream, args=(self.proc.stderr, "stderr"), daemon=True).start()
+        if self.proc is not None:
+            self.proc.deleteLater()
+
+        self._stopping = False
+        self._stderr_tail.clear()
+        self._streams = {
+            "stdout": [codecs.getincrementaldecoder("utf-8")("replace"), ""],
+            "stderr": [codecs.getincrementaldecoder("utf-8")("replace"), ""],
+        }
+        proc = QProcess(self)
+        proc.setProgram(sys.executable)
+        proc.setArguments([self.python_app_path])
+        env = QProcessEnvironment.systemEnvironment()
+        env.insert("AGENT_IPC", AGENT_IPC)
+        proc.setProcessEnvironment(env)
+        proc.readyReadStandardOutput.connect(lambda: self.read_stream(bytes(proc.readAllStandardOutput()), "stdout"))
+        proc.readyReadStandardError.connect(lambda: self.read_stream(bytes(proc.readAllStandardError()), "stderr"))
+        proc.finished.connect(self.on_app_finished)
+        proc.errorOccurred.connect(self.on_app_error)
+        self.proc = proc
+        proc.start()
 
     def stop_python_app(self):
         print("exit")
-        if self.proc and self.proc.poll() is None:
-            self.proc.terminate()
-            self.add_log_signal.emit("⏹ Python App stopped.", "stderr")
-            self.proc = None
+        self._shutdown_app()
         self.add_log_signal.emit("🛑 GUI stopped.", "stderr")
         QApplication.instance().quit()
 
+    def _shutdown_app(self):
+        """結束子程式（先 terminate，等不到再 kill），不觸發重新啟動詢問。"""
+        if self.proc is None:
+            return
+        self._stopping = True
+        if self.proc.state() != QProcess.NotRunning:
+            self.proc.closeWriteChannel()
+            self.proc.terminate()
+            if not self.proc.waitForFinished(3000):
+                self.proc.kill()
+                self.proc.waitForFinished(1000)
+            self.add_log_signal.emit("⏹ Python App stopped.", "stderr")
+
+    def closeEvent(self, event):
+        self._shutdown_app()
+        super().closeEvent(event)
+
     def send_input(self):
-        if self.proc and self.proc.poll() is None:
+        if self.proc is not None and self.proc.state() == QProcess.Running:
             text = self.input_box.text()
             if text.strip():
                 self.add_log_signal.emit(f"> {text}", "user")
-                try:
-                    self.proc.stdin.write(text + "\n")
-                    self.proc.stdin.flush()
-                except Exception as e:
-                    self.add_log_signal.emit(f"❌ Failed to send input: {e}", "stderr")
+                # QProcess.write 只放進寫入緩衝，由事件迴圈送出，子程式卡住也不會擋住 GUI
+                if self.proc.write((text + "\n").encode("utf-8")) < 0:
+                    self.add_log_signal.emit(f"❌ Failed to send input: {self.proc.errorString()}", "stderr")
             self.input_box.clear()
 
-    def read_stream(self, stream, stream_type):
-        for line in iter(stream.readline, ''):
-            if line.strip():
+    def read_stream(self, data, stream_type, final=False):
+        """把收到的位元組增量解碼、切成完整的行送進 log；不完整的最後一行留到下次。"""
+        state = self._streams[stream_type]
+        state[1] += state[0].decode(data, final=final)
+        lines = state[1].split("\n")
+        state[1] = "" if final else lines.pop()
+        for line in lines:
+            if stream_type == "stdout" and AGENT_IPC == "jsonl" and line.startswith("{"):
+                self.handle_frame(line)
+            elif line.strip():
+                if stream_type == "stderr":
+                    self._stderr_tail.append(line.strip())
                 self.add_log_signal.emit(line.strip(), stream_type)
-        stream.close()
+
+    def handle_frame(self, line):
+        """依 frame 型別繪製：token 接在同一行、選單/提醒各自上色、工具狀態與量測節流。"""
+        try:
+            frame = json.loads(line)
+            kind = frame["type"]
+        except (ValueError, KeyError, TypeError):
+            self.add_log_signal.emit(line.strip(), "stdout")
+            return
+        text = frame.get("text") or ""
+        if kind == "token":
+            self._log_queue.append((text, "stdout", True))
+        elif kind == "message_end":
+            self._log_queue.append((None, None, False))
+        elif kind in ("tool_status", "metrics"):
+            now = time.monotonic()
+            if now - self._status_shown_at.get(kind, 0.0) < STATUS_MIN_INTERVAL_SEC:
+                return
+            self._status_shown_at[kind] = now
+            if kind == "tool_status":
+                text = f"🔧 {frame.get('tool')} {frame.get('status')} ({frame.get('ms')}ms)"
+            self.add_log_signal.emit(text.strip(), "status")
+        else:
+            log_type = {"menu": "menu", "emotion_alert": "emotion"}.get(kind, "stdout")
+            for part in text.splitlines():
+                if part.strip():
+                    self.add_log_signal.emit(part.strip(), log_type)
+
+    def on_app_finished(self, exit_code, exit_status):
+        proc = self.sender() or self.proc
+        self.read_stream(bytes(proc.readAllStandardOutput()), "stdout", final=True)
+        self.read_stream(bytes(proc.readAllStandardError()), "stderr", final=True)
+        if self._stopping or proc is not self.proc:
+            return
+        if exit_status == QProcess.NormalExit and exit_code == 0:
+            self.add_log_signal.emit("⏹ Python App exited.", "system")
+            return
+        reason = "crashed" if exit_status == QProcess.CrashExit else f"exited with code {exit_code}"
+        self.add_log_signal.emit(f"💥 Python App {reason}.", "system")
+        self.offer_restart(reason)
+
+    def on_app_error(self, error):
+        # 執行中崩潰會接著收到 finished，由 on_app_finished 處理；這裡只處理啟動失敗
+        if error == QProcess.FailedToStart and not self._stopping:
+            reason = f"failed to start: {self.proc.errorString()}"
+            self.add_log_signal.emit(f"❌ Python App {reason}", "system")
+            self.offer_restart(reason)
+
+    def offer_restart(self, reason):
+        details = "\n".join(self._stderr_tail)
+        message = f"Python App {reason}.\n\nRestart it?"
+        if details:
+            message += f"\n\nLast stderr:\n{details}"
+        answer = QMessageBox.question(self, "Python App stopped", message,
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if answer == QMessageBox.Yes:
+            self.add_log_signal.emit("🔄 Restarting Python App…", "system")
+            self.start_python_app()
 
     def add_log(self, text, log_type="stdout"):
         # 不顯示 stderr（維持你原本的行為）
         if log_type == "stderr":
             return
-        elif log_type == "user":
-            color = "#00c2a8"  # 主色
-        else:
-            color = "#8ab4ff"  # 輸出藍
-        self.log_output.append(
-            f'<span style="color:{color}; '
-            f'font-family:\'Cascadia Code\',\'JetBrains Mono\',Consolas,monospace; '
-            f'font-size:14.5px; line-height:1.5;">{text}</span>'
-        )
-        self.log_output.verticalScrollBar().setValue(self.log_output.verticalScrollBar().maximum())
+        self._log_queue.append((text, log_type, False))
+
+    def flush_log(self):
+        """把排隊中的行一次寫進 log 區；使用者往上捲動閱讀時不強制捲到底。"""
+        if not self._log_queue:
+            return
+        bar = self.log_output.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum() - 4
+        cursor = QTextCursor(self.log_output.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        first = self.log_output.document().isEmpty()
+        while self._log_queue:
+            text, log_type, streaming = self._log_queue.popleft()
+            if text is None:  # message_end：下一段輸出另起一行
+                self._line_open = False
+                continue
+            if not first and not (streaming and self._line_open):
+                cursor.insertBlock()
+            first = False
+            fmt = self._log_formats.get(log_type, self._log_formats["stdout"])
+            for i, part in enumerate(text.split("\n")):
+                if i:
+                    cursor.insertBlock()
+                if part:
+                    cursor.insertText(part, fmt)
+            self._line_open = streaming
+        cursor.endEditBlock()
+        if at_bottom:
+            bar.setValue(bar.maximum())
 
 
 # ------------------ 主程式 ------------------
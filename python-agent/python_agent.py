@@ -2,7 +2,8 @@
 """
 整合版（MCP 專用；含強制正念本地音檔播放）
 - 同意前靜默（只顯示壞情緒提醒）
-- 情緒來源使用 MCP：背景偵測每輪「新建最小 Agent + nonce」，強制用工具、避免沿用舊答案
+- 情緒來源使用 MCP：預設背景輪詢，直接呼叫 emotion_detect 讀取結構化結果（不經 LLM）；
+  EMOTION_PUSH=1 時改為訂閱情緒伺服器的 /events 推播（訂閱期間伺服器會持續開著攝影機）
 - /ok 啟用後提供選單：
     /music  -> 嚴格播放驗證（play_song）
     /game   -> 紓壓小遊戲（文字引導）
@@ -10,41 +11,92 @@
     /chat   -> 情緒諮商師聊天（自然語句也能觸發 音樂/遊戲/正念）
 - 完全隱藏工具相關輸出，只顯示助理文字
 - LOG_TOOL_DEBUG=1 可暫時檢視工具事件（預設不印）
+- 確定性的指令（/game、/mind 索引、list_media/open_media）直接呼叫 MCP 工具，不經 LLM
 
 相依：
     pip install huggingface_hub
 Python：3.9+
 
 環境變數（可選）：
-    EMOTION_POLL_SEC=600          # 輪詢秒數（預設 600）
+    EMOTION_POLL_SEC=600          # 輪詢秒數（預設 600；排程器會依狀態在上下限間調整）
+    EMOTION_POLL_MIN_SEC=60       # 輪詢間隔下限（負面情緒上升時）
+    EMOTION_POLL_MAX_SEC=3600     # 輪詢間隔上限（穩定、閒置、失敗退避時）
+    EMOTION_DAILY_BUDGET_SEC=0    # 每日攝影機/推論秒數上限（0 = 不限）
     BAD_EMOTIONS="angry,disgust,fear,sad, happy, neutral, surprise"
     LOG_EMOTION_DEBUG=1           # 顯示 MCP 情緒偵測除錯
     LOG_TOOL_DEBUG=1              # 顯示工具事件除錯（預設關）
+    TOOL_POOL_SIZE=1              # 常駐無記憶工具 Agent 數量（預設 1）
+    TOOL_POOL_HEALTH_SEC=30       # 借出前健康檢查（ping）的最短間隔秒數
+    LOG_METRICS=1                 # 顯示工具過濾前後的 prompt token 估計與各伺服器連線/列工具耗時
+    TOOL_CACHE_PATH=...           # 工具 schema 快取檔（預設 python-agent/tool_schema_cache.json）
+    EMOTION_PUSH=0                # 1 = 訂閱 /events 推播（攝影機常駐）；預設 0 = 依排程輪詢
+    EMOTION_EVENTS_URL=http://127.0.0.1:8001/events
+    MUSIC_CACHE_PATH=...          # 音樂查詢 -> play_song 參數快取（預設 python-agent/music_query_cache.json）
+    MUSIC_CACHE_SIZE=200          # 快取筆數上限（LRU 淘汰；0 = 停用）
+    MUSIC_CACHE_TTL_SEC=604800    # 快取有效秒數（預設 7 天）
+    STREAM_FLUSH_MS=50            # 串流文字累積多久才寫出一次（0 = 每個片段都寫出）
+    STREAM_FLUSH_CHARS=256        # 累積超過此字數立即寫出
+    AGENT_IPC=jsonl               # 輸出改為一行一個 JSON frame（GUI 用）；預設 text 給 CLI
+
+huggingface_hub（約 1 秒）在 chat_loop 啟動時於背景執行緒載入，第一次建 Agent 前不會擋住輸入。
 """
+from __future__ import annotations
 
 import os
 import re
+import sys
 import json
 import asyncio
+import time
+import random
+import shutil
+import hashlib
+import datetime
+import io
+import atexit
 import contextlib
-from typing import Optional, Tuple
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Optional, Tuple
 
 
-from huggingface_hub.inference._mcp.agent import Agent
+if TYPE_CHECKING:
+    from huggingface_hub.inference._mcp.agent import Agent
 
 # ---------------------- 路徑與設定 ----------------------
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 AGENT_JSON_PATH = os.path.join(PROJECT_ROOT, "agent.json")
+TOOL_CACHE_PATH = os.environ.get("TOOL_CACHE_PATH", os.path.join(SCRIPT_DIR, "tool_schema_cache.json"))
+MUSIC_CACHE_PATH = os.environ.get("MUSIC_CACHE_PATH", os.path.join(SCRIPT_DIR, "music_query_cache.json"))
 
 # ---------------------- 參數（可用環境變數覆寫） ----------------------
 POLL_INTERVAL_SEC = int(os.environ.get("EMOTION_POLL_SEC", "600"))  # 預設 600 秒
+POLL_MIN_SEC = float(os.environ.get("EMOTION_POLL_MIN_SEC", "60"))
+POLL_MAX_SEC = float(os.environ.get("EMOTION_POLL_MAX_SEC", "3600"))
+DAILY_BUDGET_SEC = float(os.environ.get("EMOTION_DAILY_BUDGET_SEC", "0"))
+IDLE_AFTER_SEC = 900  # 超過此秒數沒有使用者輸入視為閒置
 BAD_EMOTIONS = {e.strip().lower() for e in os.environ.get(
     "BAD_EMOTIONS",
     "angry, disgust, fear, sad"
 ).split(",") if e.strip()}
 LOG_EMOTION_DEBUG = os.environ.get("LOG_EMOTION_DEBUG", "0") == "1"
 LOG_TOOL_DEBUG = os.environ.get("LOG_TOOL_DEBUG", "0") == "1"
+LOG_METRICS = os.environ.get("LOG_METRICS", "0") == "1"
+TOOL_POOL_SIZE = max(1, int(os.environ.get("TOOL_POOL_SIZE", "1")))
+TOOL_POOL_HEALTH_SEC = float(os.environ.get("TOOL_POOL_HEALTH_SEC", "30"))
+TOOL_POOL_PING_TIMEOUT_SEC = 5.0
+EMOTION_PUSH = os.environ.get("EMOTION_PUSH", "0") == "1"
+EMOTION_EVENTS_URL = os.environ.get("EMOTION_EVENTS_URL", "http://127.0.0.1:8001/events")
+EMOTION_STALE_SEC = 120  # 推播中的讀數超過此秒數視為過期，不據以提醒
+EMOTION_PUSH_MAX_BACKOFF_SEC = 60.0
+EMOTION_PUSH_MAX_FAILURES = 5  # 連續重連失敗幾次後改回輪詢
+IPC_JSONL = os.environ.get("AGENT_IPC", "text").strip().lower() == "jsonl"
+STREAM_FLUSH_SEC = max(0.0, float(os.environ.get("STREAM_FLUSH_MS", "50")) / 1000.0)
+STREAM_FLUSH_CHARS = max(1, int(os.environ.get("STREAM_FLUSH_CHARS", "256")))
+MUSIC_CACHE_SIZE = max(0, int(os.environ.get("MUSIC_CACHE_SIZE", "200")))
+MUSIC_CACHE_TTL_SEC = float(os.environ.get("MUSIC_CACHE_TTL_SEC", str(7 * 24 * 3600)))
 
 # 同意前完全靜默（除了情緒通知）
 SILENT_BEFORE_CONSENT = True
@@ -60,6 +112,7 @@ MENU_TEXT = (
     "  • /mind [索引或關鍵字]  播放本地正念音檔（例：/mind 2 或 /mind 放鬆）\n"
     "  • /chat                 與情緒諮商師聊天（聊天也能自然說：想聽音樂/玩遊戲/做正念）\n"
     "  • /reset                重設聊天對話（不影響工具執行的無記憶模式）\n"
+    "  • /no                   結束協助（之後偵測到情緒不佳時會再詢問你）\n"
     "  （隨時輸入 /menu 返回本選單）\n"
 )
 
@@ -112,15 +165,75 @@ MINDFUL_PLAY_INSTRUCTION = (
     "F) JSON 之外可有極簡說明，但最後一行必須是那行 JSON。\n"
 )
 
-# 小遊戲（只允許 open_in_browser；最後一行輸出工具原始 JSON；不傳路徑）
-PUZZLE_OPEN_INSTRUCTION = (
-    "任務：開啟紓壓小遊戲（瀏覽器版拼圖）。\n"
-    "硬性規則：\n"
-    "A) 你【只能】呼叫名為 open_in_browser 的 MCP 工具（不要呼叫其他工具，也不要自行產生 HTML）。\n"
-    "B) 呼叫完成後，請將 open_in_browser 工具『原始回傳的 JSON』作為回覆的『最後一行，且只有一行 JSON』輸出；不得改寫或新增欄位。\n"
-    "C) 嚴禁口頭宣稱成功而未真的呼叫工具。\n"
-    "說明：puzzle-mcp 伺服器已內建 puzzle.html 的位置，無需傳入任何目錄參數；工具通常回傳形如 {\"temp_path\": \"...\"}。\n"
-)
+# ---------------------- 輸出通道（文字 / JSONL frame） ----------------------
+# AGENT_IPC=jsonl 時，stdout 每一行都是一個帶 type 的 JSON 物件，GUI 依型別分別繪製/節流：
+#   {"type": "token", "text": ...}          助理串流文字（已合併的片段）
+#   {"type": "message_end"}                 一則助理回覆結束
+#   {"type": "emotion_alert", "text": ...}  情緒偵測提醒
+#   {"type": "menu", "text": ...}           功能選單
+#   {"type": "tool_status", "tool": ..., "status": "ok" | "error", "ms": ...}
+#   {"type": "metrics", "text": ...}        LOG_METRICS 的量測行
+#   {"type": "text", "text": ...}           其他一般輸出（既有的 print 自動包成此型別）
+# 輸入仍是一行一個使用者訊息的純文字。
+_FRAME_OUT = None  # JSONL 模式下真正的 stdout
+# ainput() 在工作執行緒跑 input()，它會從該執行緒寫入並 flush sys.stdout（提示字串）；
+# frame 的寫出與 _FramedStdout 的行緩衝一律在此鎖內進行，避免 frame 交錯或遺失片段
+_FRAME_LOCK = threading.RLock()
+
+
+def emit_frame(kind: str, **fields):
+    out = _FRAME_OUT or sys.stdout
+    line = json.dumps({"type": kind, **fields}, ensure_ascii=False) + "\n"
+    with _FRAME_LOCK:
+        out.write(line)
+        out.flush()
+
+
+class _FramedStdout(io.TextIOBase):
+    """JSONL 模式下取代 sys.stdout：一般 print 的輸出以行為單位包成 {"type": "text"} frame。"""
+
+    def __init__(self):
+        self._pending = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        with _FRAME_LOCK:
+            self._pending += text
+            while "\n" in self._pending:
+                line, self._pending = self._pending.split("\n", 1)
+                emit_frame("text", text=line)
+        return len(text)
+
+    def flush(self):
+        with _FRAME_LOCK:
+            if self._pending:
+                emit_frame("text", text=self._pending)
+                self._pending = ""
+
+
+def install_framed_stdout():
+    global _FRAME_OUT
+    if _FRAME_OUT is None:
+        _FRAME_OUT = sys.stdout
+        sys.stdout = _FramedStdout()
+
+
+def ui_event(kind: str, text: Optional[str] = None, **fields):
+    """
+    輸出一則帶型別的訊息：JSONL 模式送出 frame；文字模式只印 text（沒有 text 的事件，例如 tool_status，不印）。
+    """
+    if IPC_JSONL and _FRAME_OUT is not None:
+        if text is not None:
+            fields["text"] = text
+        emit_frame(kind, **fields)
+    elif text is not None:
+        print(text, end="" if text.endswith("\n") else "\n", flush=True)
+
+
+def log_metric(text: str):
+    ui_event("metrics", text)
 
 # ---------------------- 小工具函式 ----------------------
 
@@ -146,112 +259,602 @@ async def ainput(prompt: str) -> str:
     """非同步版 input，避免阻塞事件圈。"""
     return await asyncio.to_thread(input, prompt)
 
-def _extract_last_json_line(text: str) -> Optional[dict]:
-    """從助理輸出的最後一行或全文中抓取 JSON 物件。"""
-    if not text:
-        return None
-    last_line = text.strip().splitlines()[-1].strip()
-    if last_line.startswith("```") and last_line.endswith("```"):
-        last_line = last_line.strip("`").strip()
-    if last_line.lower().startswith("json"):
-        last_line = last_line[4:].strip()
-    try:
-        return json.loads(last_line)
-    except Exception:
-        m = list(re.finditer(r"\{.*?\}", text, re.DOTALL))
-        if m:
-            try:
-                return json.loads(m[-1].group(0))
-            except Exception:
-                return None
-        return None
+# ==== 自然語句 → 意圖判斷（規則式，預先編譯的意圖註冊表） ====
+class IntentEngine:
+    """
+    意圖註冊表。同一命名空間的所有規則預先合併成一個 alternation：(?P<_0>規則1)|(?P<_1>規則2)|...
+    每則訊息先用它 search 一次：沒有命中（大多數聊天訊息）就結束，新增意圖不會多掃描；
+    命中第 k 條時，只需再確認優先權更高（註冊較早）的規則是否也出現在其他位置，
+    結果與依序逐條 re.search 相同。slot 規則（含 (?P<q>...)）預先編譯，命中意圖後依序套用。
+    """
+
+    def __init__(self, flags=re.I):
+        self._flags = flags
+        self._rules: dict = {}     # namespace -> [(intent, pattern)]
+        self._slots: dict = {}     # (namespace, intent) -> [pattern]
+        self._compiled: dict = {}  # namespace -> (合併 regex, [逐條 regex])；(namespace, intent) -> [slot regex]
+
+    def register(self, namespace: str, intent: str, *patterns, slot_patterns=()):
+        self._rules.setdefault(namespace, []).extend((intent, p) for p in patterns)
+        if slot_patterns:
+            self._slots.setdefault((namespace, intent), []).extend(slot_patterns)
+        self._compiled.clear()
+
+    def _namespace(self, namespace: str):
+        if namespace not in self._compiled:
+            patterns = [p for _, p in self._rules.get(namespace, [])]
+            combined = "|".join(f"(?P<_{i}>{p})" for i, p in enumerate(patterns)) or r"(?!)"
+            self._compiled[namespace] = (re.compile(combined, self._flags),
+                                         [re.compile(p, self._flags) for p in patterns])
+        return self._compiled[namespace]
+
+    def match(self, text: str, namespace: str):
+        """回傳 (intent, slot) 或 None；有註冊 slot 規則的意圖會一併抽取 slot（抽不到為 ""）。"""
+        combined, singles = self._namespace(namespace)
+        m = combined.search(text)
+        if m is None:
+            return None
+        hit = int(m.lastgroup[1:])
+        for i in range(hit):
+            if singles[i].search(text):
+                hit = i
+                break
+        intent = self._rules[namespace][hit][0]
+        if (namespace, intent) in self._slots:
+            return intent, self.extract(text, namespace, intent)
+        return intent, None
+
+    def extract(self, text: str, namespace: str, intent: str) -> str:
+        """依註冊順序套用 slot 規則，回傳第一條命中的 q 群組（去頭尾空白）。"""
+        key = (namespace, intent)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self._compiled[key] = [re.compile(p, self._flags) for p in self._slots.get(key, [])]
+        for pattern in compiled:
+            m = pattern.search(text)
+            if m:
+                return m.group("q").strip()
+        return ""
+
+
+INTENTS = IntentEngine()
+# 聊天中的自然語句（依註冊順序決定優先權：音樂 > 遊戲 > 正念）
+INTENTS.register(
+    "chat", "music",
+    r"(想|要|可以)?(聽|播|播放).*?(歌|音樂)",
+    r"(來|放)一?首",
+    r"音樂.*(放|播)",
+    slot_patterns=(
+        r"(聽|播|播放|來|放).*?(?P<q>周杰倫|五月天|lo-?fi|lofi|鋼琴|放鬆|輕音樂|抒情|搖滾|爵士|古典|電音|hip[- ]?hop|rap|白噪音|日文|韓文|英文|中文|中文歌|日語|韓語)",
+        r"想.*?聽(?P<q>.+?)(的歌)?$",
+        r"(來|放).*?一?首(?P<q>.+)$",
+    ),
+)
+INTENTS.register("chat", "game", r"(想|要|可以)?(玩|來).*?(遊戲|小遊戲)", r"紓壓.*(遊戲)")
+INTENTS.register("chat", "mind", r"(想|要|可以)?.*?(正念|冥想|呼吸練習|身體掃描|放鬆練習)")
+# 選單模式的關鍵字捷徑（與 /game、/mind、/chat 同義）
+INTENTS.register("menu", "game", r"玩紓壓")
+INTENTS.register("menu", "mind", r"正念|冥想")
+INTENTS.register("menu", "chat", r"聊天")
 
-# ==== 自然語句 → 意圖判斷（規則式） ====
-import re as _re
-
-INTENT_PATTERNS = {
-    "music": [
-        r"(想|要|可以)?(聽|播|播放).*?(歌|音樂)",
-        r"(來|放)一?首",
-        r"音樂.*(放|播)",
-    ],
-    "game": [
-        r"(想|要|可以)?(玩|來).*?(遊戲|小遊戲)",
-        r"紓壓.*(遊戲)",
-    ],
-    "mind": [
-        r"(想|要|可以)?.*?(正念|冥想|呼吸練習|身體掃描|放鬆練習)",
-    ],
-}
 
 def detect_intent(text: str):
     t = text.strip().lower()
     if t.startswith(("/music", "/game", "/mind", "/menu", "/end", "/reset")):
         return None
-    for intent, pats in INTENT_PATTERNS.items():
-        for pat in pats:
-            if _re.search(pat, text, _re.I):
-                if intent == "music":
-                    q = parse_music_query(text)
-                    return ("music", q)
-                return (intent, None)
-    return None
+    return INTENTS.match(text, "chat")
 
 def parse_music_query(text: str) -> str:
-    m = _re.search(
-        r"(聽|播|播放|來|放).*?(?P<q>周杰倫|五月天|lo-?fi|lofi|鋼琴|放鬆|輕音樂|抒情|搖滾|爵士|古典|電音|hip[- ]?hop|rap|白噪音|日文|韓文|英文|中文|中文歌|日語|韓語)",
-        text, _re.I
-    )
-    if m:
-        return m.group("q").strip()
-    m = _re.search(r"想.*?聽(?P<q>.+?)(的歌)?$", text, _re.I)
-    if m:
-        return m.group("q").strip()
-    m = _re.search(r"(來|放).*?一?首(?P<q>.+)$", text, _re.I)
-    if m:
-        return m.group("q").strip()
-    return ""
+    return INTENTS.extract(text, "chat", "music")
+
+# ---------------------- 快速啟動 Agent（工具 schema 快取 + 平行連線） ----------------------
+def _server_cache_key(cfg: dict) -> str:
+    """以伺服器設定與執行檔/腳本的 mtime 計算快取鍵；任何一項改變都會讓快取失效。"""
+    conf = cfg.get("config") or {}
+    stamps = []
+    for item in [conf.get("command"), *(conf.get("args") or [])]:
+        if not isinstance(item, str):
+            continue
+        path = item if os.path.isfile(item) else shutil.which(item)
+        if path and os.path.isfile(path):
+            stamps.append([path, os.path.getmtime(path)])
+    raw = json.dumps({"cfg": cfg, "mtimes": stamps}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
 
-# ---------------------- 無記憶工具呼叫：關鍵修正 ----------------------
+def _read_tool_cache() -> dict:
+    try:
+        with open(TOOL_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _write_tool_cache(key: str, tools: list):
+    cache = _read_tool_cache()
+    cache[key] = tools
+    tmp = TOOL_CACHE_PATH + ".tmp"
+    with contextlib.suppress(Exception):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp, TOOL_CACHE_PATH)
+
+
+async def _open_mcp_transport(stack: contextlib.AsyncExitStack, type: str, params: dict):
+    """依伺服器類型開啟 MCP 傳輸層（與 MCPClient.add_mcp_server 相同的參數）。"""
+    if type == "stdio":
+        from mcp import StdioServerParameters
+        from mcp.client.stdio import stdio_client
+        kwargs = {"command": params["command"]}
+        for key in ("args", "env", "cwd"):
+            if params.get(key) is not None:
+                kwargs[key] = params[key]
+        return await stack.enter_async_context(stdio_client(StdioServerParameters(**kwargs)))
+    if type == "sse":
+        from mcp.client.sse import sse_client
+        kwargs = {k: params[k] for k in ("url", "headers", "timeout", "sse_read_timeout") if params.get(k) is not None}
+        return await stack.enter_async_context(sse_client(**kwargs))
+    if type == "http":
+        from mcp.client.streamable_http import streamablehttp_client
+        kwargs = {k: params[k] for k in ("url", "headers", "timeout", "sse_read_timeout", "terminate_on_close")
+                  if params.get(k) is not None}
+        read, write, _ = await stack.enter_async_context(streamablehttp_client(**kwargs))
+        return read, write
+    raise ValueError(f"Unsupported server type: {type}")
+
+
+_FAST_BOOT_AGENT = None
+_FAST_BOOT_AGENT_LOCK = threading.Lock()
+
+
+def _fast_boot_agent_class():
+    """第一次用到時才 import huggingface_hub 並建立 FastBootAgent 類別（可在背景執行緒預先呼叫）。"""
+    global _FAST_BOOT_AGENT
+    with _FAST_BOOT_AGENT_LOCK:
+        if _FAST_BOOT_AGENT is not None:
+            return _FAST_BOOT_AGENT
+        from huggingface_hub import ChatCompletionInputTool
+        from huggingface_hub.inference._mcp.agent import Agent
+
+        class FastBootAgent(Agent):
+            """
+            啟動較快的 Agent：
+            - 所有 MCP 伺服器同時連線（每台由自己的 task 持有連線，關閉時也在同一個 task 內）
+            - 工具 schema 快取在磁碟；全部命中時 load_tools() 立刻返回，連線與重新驗證在背景進行，
+              伺服器回報的工具若與快取不同，就更新工具清單與快取
+            - run() / wait_ready() 會先等所有伺服器連上；session_for() 只等提供該工具的那一台
+            - LOG_METRICS=1 時印出各伺服器的連線與列工具耗時
+            """
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.tool_filter: Optional[set] = None  # 由 apply_tool_allowlist 設定
+                self._server_tools: list = [[] for _ in self._servers_cfg]
+                self._server_sessions: list = [None] * len(self._servers_cfg)
+                self._server_ready: list = []
+                self._server_tasks: list = []
+                self._stop_servers = asyncio.Event()
+
+            def _rebuild_tools(self):
+                """依設定順序重建 available_tools / sessions（同名工具以先出現的伺服器為準）。"""
+                tools, sessions = [], {}
+                for schemas, session in zip(self._server_tools, self._server_sessions):
+                    for schema in schemas:
+                        name = schema["name"]
+                        if any(t.function.name == name for t in tools):
+                            continue
+                        if session is not None:
+                            sessions[name] = session
+                        if self.tool_filter is None or name in self.tool_filter:
+                            tools.append(ChatCompletionInputTool.parse_obj_as_instance(
+                                {"type": "function", "function": schema}))
+                self.available_tools[:] = tools
+                self.sessions.clear()
+                self.sessions.update(sessions)
+
+            async def _serve(self, idx: int, cfg: dict, key: str, ready: asyncio.Future):
+                from mcp import ClientSession
+
+                conf = cfg.get("config") or {}
+                label = cfg.get("name") or conf.get("url") or " ".join([conf.get("command", ""), *(conf.get("args") or [])[-1:]])
+                started = time.monotonic()
+                try:
+                    async with contextlib.AsyncExitStack() as stack:
+                        read, write = await _open_mcp_transport(stack, cfg["type"], dict(cfg.get("config") or {}))
+                        session = await stack.enter_async_context(ClientSession(read, write))
+                        await session.initialize()
+                        connected = time.monotonic()
+                        listed = (await session.list_tools()).tools
+                        done = time.monotonic()
+                        schemas = [{"name": t.name, "description": t.description, "parameters": t.inputSchema}
+                                   for t in listed]
+                        if schemas != self._server_tools[idx]:
+                            self._server_tools[idx] = schemas
+                            _write_tool_cache(key, schemas)
+                        self._server_sessions[idx] = session
+                        self._rebuild_tools()
+                        if LOG_METRICS:
+                            log_metric(f"[METRIC] startup server={label} "
+                                  f"connect={(connected - started) * 1000:.0f}ms list={(done - connected) * 1000:.0f}ms "
+                                  f"tools={len(schemas)}")
+                        ready.set_result(True)
+                        await self._stop_servers.wait()
+                except asyncio.CancelledError:
+                    if not ready.done():
+                        ready.cancel()
+                    raise
+                except Exception as e:
+                    if not ready.done():
+                        ready.set_exception(e)
+                    else:
+                        print(f"[系統] ⚠️ MCP 伺服器連線中斷：{label}：{e}")
+                finally:
+                    self._server_sessions[idx] = None
+
+            async def load_tools(self) -> None:
+                started = time.monotonic()
+                cache = _read_tool_cache()
+                loop = asyncio.get_running_loop()
+                missing = []
+                for idx, cfg in enumerate(self._servers_cfg):
+                    key = _server_cache_key(cfg)
+                    cached = cache.get(key)
+                    if cached is not None:
+                        self._server_tools[idx] = cached
+                    ready = loop.create_future()
+                    self._server_ready.append(ready)
+                    self._server_tasks.append(asyncio.create_task(self._serve(idx, cfg, key, ready)))
+                    if cached is None:
+                        missing.append(ready)
+                self._rebuild_tools()
+                # 快取未命中的伺服器必須等它列出工具；全部命中則立刻可用
+                for ready in missing:
+                    await ready
+                if LOG_METRICS:
+                    log_metric(f"[METRIC] load_tools {(time.monotonic() - started) * 1000:.0f}ms "
+                          f"(cache hits {len(self._servers_cfg) - len(missing)}/{len(self._servers_cfg)})")
+
+            async def wait_ready(self):
+                """等所有伺服器連線完成（失敗的伺服器不丟例外，其工具呼叫會回報找不到 session）。"""
+                if self._server_ready:
+                    await asyncio.gather(*self._server_ready, return_exceptions=True)
+
+            async def session_for(self, tool_name: str):
+                """回傳提供該工具的 MCP session（同名工具以先出現的伺服器為準）；只等那一台伺服器連上。"""
+                for idx, schemas in enumerate(self._server_tools):
+                    if any(schema["name"] == tool_name for schema in schemas):
+                        if idx < len(self._server_ready):
+                            await asyncio.gather(self._server_ready[idx], return_exceptions=True)
+                        break
+                else:
+                    # 快取裡沒有這個工具：可能是伺服器新增的，等全部連上再找
+                    await self.wait_ready()
+                return self.sessions.get(tool_name)
+
+            async def run(self, user_input: str, **kwargs):
+                await self.wait_ready()
+                async for item in super().run(user_input, **kwargs):
+                    yield item
+
+            async def cleanup(self):
+                self._stop_servers.set()
+                if self._server_tasks:
+                    await asyncio.gather(*self._server_tasks, return_exceptions=True)
+                await super().cleanup()
+
+        _FAST_BOOT_AGENT = FastBootAgent
+        return _FAST_BOOT_AGENT
+
+
+def new_agent(**kwargs) -> "Agent":
+    """建立 FastBootAgent（參數同 huggingface_hub Agent）。"""
+    return _fast_boot_agent_class()(**kwargs)
+
+
+# ---------------------- 無記憶工具呼叫：常駐連線池 ----------------------
 BASE_CFG: Optional[dict] = None  # 由 main() 設定
 
-async def tool_call_stateless(user_text: str) -> str:
+STATELESS_PROMPT = (
+    "You are a stateless tool runner. "
+    "Never rely on prior conversation or assumed state. "
+    "For every request you MUST call the specified MCP tool and base your final single-line JSON strictly on the tool's raw response."
+)
+
+
+class _PooledAgent:
+    """
+    池中的一個常駐 Agent。
+    由專屬的 holder task 進入/離開 Agent 的 async context（MCP 連線的 task group
+    必須在同一個 task 內開關），借用者只透過 sessions 呼叫工具。
     """
-    每次動作都用「一次性、無記憶」的 micro-agent 執行，避免沿用舊上下文。
+
+    def __init__(self, cfg: dict, prompt: str, on_load=None):
+        self._cfg = cfg
+        self._prompt = prompt
+        self._on_load = on_load
+        self.agent: Optional[Agent] = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_ok = 0.0
+        self.broken = False
+
+    async def _hold(self):
+        try:
+            async with new_agent(
+                model=self._cfg["model"],
+                base_url="http://localhost:8000/api/",
+                servers=self._cfg["servers"],
+                prompt=self._prompt,
+            ) as a:
+                # 工具清單全部命中快取時 load_tools() 立刻返回，不等伺服器連線：
+                # run() 與 session_for() 會在真正用到時才等待對應的伺服器
+                await a.load_tools()
+                if self._on_load is not None:
+                    self._on_load(a)
+                self.agent = a
+                self._last_ok = time.monotonic()
+                self._ready.set()
+                await self._stop.wait()
+        finally:
+            self.agent = None
+            self._ready.set()
+
+    async def open(self):
+        self._task = asyncio.create_task(self._hold())
+        await self._ready.wait()
+        if self.agent is None:
+            # 啟動失敗：把 holder task 的例外丟回給呼叫端
+            await self._task
+            raise RuntimeError("MCP 工具 Agent 啟動失敗")
+
+    def reset(self):
+        """清掉對話，只保留 system prompt（維持「無記憶」保證）。"""
+        if self.agent is not None:
+            del self.agent.messages[1:]
+
+    async def healthy(self) -> bool:
+        if self.broken or self.agent is None or self._task is None or self._task.done():
+            return False
+        now = time.monotonic()
+        if now - self._last_ok < TOOL_POOL_HEALTH_SEC:
+            return True
+        sessions = {id(s): s for s in self.agent.sessions.values()}
+        try:
+            for session in sessions.values():
+                await asyncio.wait_for(session.send_ping(), TOOL_POOL_PING_TIMEOUT_SEC)
+        except Exception:
+            return False
+        self._last_ok = now
+        return True
+
+    def suspect(self):
+        """借用期間發生錯誤：下次借出前一定重新 ping，確認 MCP session 還活著才沿用。"""
+        self._last_ok = 0.0
+
+    async def close(self):
+        self._stop.set()
+        if self._task is not None:
+            with contextlib.suppress(BaseException):
+                await asyncio.wait_for(self._task, TOOL_POOL_PING_TIMEOUT_SEC * 2)
+
+
+class StatelessAgentPool:
+    """
+    常駐的無記憶工具 Agent 池：
+    - 第一次借用時才啟動（不影響同意前的靜默）
+    - 借出前做健康檢查（ping 各 MCP session），失敗就重建
+    - 借用期間出錯（LLM HTTP 錯誤、找不到工具等）不直接丟棄，只讓下次借出前必定 ping；
+      只有 session/傳輸層真的斷了（ping 失敗、holder task 結束）才重建該流程的 MCP 伺服器
+    - 同時借出數以 semaphore 限制在 size；歸還或丟棄 Agent 都會釋放名額，等待者不會卡住
+    - 每次借出/歸還都清空對話，行為與「每次新建 Agent」相同，但不必重新啟動伺服器
+    - on_load：每個 Agent 載入工具後呼叫一次（例如依流程過濾工具清單）
+    """
+
+    def __init__(self, cfg: dict, size: int = TOOL_POOL_SIZE, prompt: str = STATELESS_PROMPT, on_load=None):
+        self._cfg = cfg
+        self._size = size
+        self._prompt = prompt
+        self._on_load = on_load
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._slots: list = []
+        # 每個借用者最多持有一個 Agent，所以「閒置 + 借出 + 啟動中」的 Agent 數不會超過 size
+        self._sem = asyncio.Semaphore(size)
+        self._closed = False
+
+    async def _spawn(self) -> _PooledAgent:
+        slot = _PooledAgent(self._cfg, self._prompt, self._on_load)
+        await slot.open()
+        self._slots.append(slot)
+        return slot
+
+    async def _discard(self, slot: _PooledAgent):
+        with contextlib.suppress(ValueError):
+            self._slots.remove(slot)
+        await slot.close()
+
+    async def _replace(self, slot: _PooledAgent) -> _PooledAgent:
+        """關閉壞掉的 Agent 並重建（重建失敗時舊的仍標記為 broken，歸還時會被丟棄）。"""
+        slot.broken = True
+        await self._discard(slot)
+        return await self._spawn()
+
+    @contextlib.asynccontextmanager
+    async def borrow(self):
+        if self._closed:
+            raise RuntimeError("工具連線池已關閉")
+        async with self._sem:
+            slot = self._idle.get_nowait() if not self._idle.empty() else await self._spawn()
+            try:
+                if not await slot.healthy():
+                    if LOG_TOOL_DEBUG:
+                        print("\n[TOOL-DEBUG] pooled agent unhealthy, respawning\n")
+                    slot = await self._replace(slot)
+                slot.reset()
+                yield slot.agent
+            except BaseException:
+                slot.suspect()
+                raise
+            finally:
+                slot.reset()
+                if slot.broken or self._closed:
+                    await self._discard(slot)
+                else:
+                    self._idle.put_nowait(slot)
+
+    async def close(self):
+        self._closed = True
+        slots, self._slots = self._slots, []
+        for slot in slots:
+            await slot.close()
+
+
+def _load_cfg() -> dict:
+    if BASE_CFG is not None:
+        return BASE_CFG
+    with open(AGENT_JSON_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def servers_for(cfg: dict, flow: str) -> list:
+    """
+    依 agent.json 的 routes 回傳某個流程（music/mind/game/emotion/chat）需要的 MCP 伺服器設定。
+    沒有 routes 或該流程未列出時沿用全部伺服器；回傳前去掉 name 欄位（Agent 不認得）。
+    """
+    names = (cfg.get("routes") or {}).get(flow)
+    servers = cfg["servers"]
+    if names is not None:
+        known = {srv.get("name") for srv in servers}
+        for name in names:
+            if name not in known:
+                print(f"[系統] ⚠️ agent.json routes.{flow} 指定了不存在的伺服器：{name}")
+        servers = [srv for srv in servers if srv.get("name") in names]
+    return [{k: v for k, v in srv.items() if k != "name"} for srv in servers]
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗估 token 數：CJK 字元約一字一 token，其餘約每 4 個字元一 token。"""
+    cjk = sum(1 for ch in text if "\u3000" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _tools_prompt_tokens(tools: list) -> int:
+    return _estimate_tokens(json.dumps(tools, ensure_ascii=False, default=str))
+
+
+def apply_tool_allowlist(agent: Agent, cfg: dict, flow: str):
+    """
+    依 agent.json 的 tools.<flow> 只保留允許的工具 schema（送進 LLM prompt 的部分），
+    sessions 不動，直接呼叫工具不受影響。沒有設定 allow-list 時保留全部工具。
+    LOG_METRICS=1 時印出過濾前後的工具數與 prompt token 估計。
+    """
+    allowed = (cfg.get("tools") or {}).get(flow)
+    before = list(agent.available_tools)
+    if allowed is not None:
+        if hasattr(agent, "tool_filter"):
+            agent.tool_filter = set(allowed)  # 背景重新驗證工具清單時也套用
+        agent.available_tools[:] = [t for t in before if t.function.name in allowed]
+    if LOG_METRICS:
+        sys_tokens = _estimate_tokens(str(agent.messages[0].get("content", ""))) if agent.messages else 0
+        log_metric(
+            f"[METRIC] flow={flow} tools {len(before)}->{len(agent.available_tools)} "
+            f"prompt_tokens≈{sys_tokens + _tools_prompt_tokens(before)}"
+            f"->{sys_tokens + _tools_prompt_tokens(agent.available_tools)}"
+        )
+
+
+TOOL_POOLS: dict = {}  # flow -> StatelessAgentPool
+
+
+def _get_tool_pool(flow: str) -> StatelessAgentPool:
+    pool = TOOL_POOLS.get(flow)
+    if pool is None:
+        cfg = _load_cfg()
+        pool = StatelessAgentPool({"model": cfg["model"], "servers": servers_for(cfg, flow)},
+                                  on_load=lambda a: apply_tool_allowlist(a, cfg, flow))
+        TOOL_POOLS[flow] = pool
+    return pool
+
+
+async def close_tool_pool():
+    pools = list(TOOL_POOLS.values())
+    TOOL_POOLS.clear()
+    for pool in pools:
+        with contextlib.suppress(Exception):
+            await pool.close()
+
+
+async def tool_call_stateless(user_text: str, flow: str, tool_calls: Optional[list] = None) -> str:
+    """
+    每次動作都用「無記憶」的 micro-agent 執行，避免沿用舊上下文。
+    Agent 從該流程的常駐連線池借出（對話已清空，只連該流程需要的伺服器），
+    不必每次重新啟動所有 MCP 伺服器。
     只用於需要嚴格確認工具回傳(JSON)的流程。
     """
-    if BASE_CFG is None:
-        with open(AGENT_JSON_PATH, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
-    else:
-        cfg = BASE_CFG
-
-    async with Agent(
-        model=cfg["model"],
-        base_url="http://localhost:8000/api/",
-        servers=cfg["servers"],
-        prompt=(
-            "You are a stateless tool runner. "
-            "Never rely on prior conversation or assumed state. "
-            "For every request you MUST call the specified MCP tool and base your final single-line JSON strictly on the tool's raw response."
-        ),
-    ) as a:
-        await a.load_tools()
-        return await run_agent_and_capture(a, user_text)
+    async with _get_tool_pool(flow).borrow() as a:
+        return await run_agent_and_capture(a, user_text, tool_calls)
 
-# ---------------------- 小遊戲（open_in_browser；讀原始 JSON 判定） ----------------------
-async def open_puzzle_game(agent: Agent) -> bool:
+# ---------------------- 直接工具呼叫（不經 LLM 的快速路徑） ----------------------
+def _tool_result_payload(result):
     """
-    強制只呼叫 open_in_browser()，最後一行鏡射工具原始 JSON。
-    成功判定：JSON 內含可用欄位（例如 'temp_path' 為非空字串）。
+    把 MCP CallToolResult 轉成 Python 值：
+    - 有 structuredContent 就直接用（FastMCP 會把非 dict 回傳包成 {"result": ...}）
+    - 否則合併文字內容，能解析成 JSON 就解析，不能就回傳原字串
     """
-    prompt = PUZZLE_OPEN_INSTRUCTION + "\n---\n請立刻開啟紓壓小遊戲。"
-    text = await tool_call_stateless(prompt)
+    structured = _get_attr(result, "structuredContent")
+    if isinstance(structured, dict) and structured:
+        if set(structured) == {"result"}:
+            return structured["result"]
+        return structured
+    texts = []
+    for item in _get_attr(result, "content") or []:
+        if _get_attr(item, "type") == "text":
+            texts.append(_get_attr(item, "text") or "")
+    text = "\n".join(texts).strip()
+    try:
+        return json.loads(text)
+    except Exception:
+        return text
 
-    if text:
-        print(text)
+async def call_tool_direct(tool_name: str, arguments: Optional[dict] = None,
+                           flow: str = "chat", pool: Optional["StatelessAgentPool"] = None):
+    """
+    直接呼叫指定的 MCP 工具並回傳解析後的結果；工具回報錯誤時丟出 RuntimeError。
+    用於結果完全可預期的指令（不需要語意理解），省下整輪 LLM 生成。
+    pool 省略時使用 flow 對應的工具連線池。
+    """
+    started = time.monotonic()
+    async with (pool or _get_tool_pool(flow)).borrow() as a:
+        session = await a.session_for(tool_name)
+        if session is None:
+            raise RuntimeError(f"找不到 MCP 工具：{tool_name}")
+        result = await session.call_tool(tool_name, arguments or {})
+    payload = _tool_result_payload(result)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    ui_event("tool_status", tool=tool_name, status="error" if _get_attr(result, "isError") else "ok",
+             ms=round(elapsed_ms))
+    if LOG_TOOL_DEBUG:
+        print(f"\n[TOOL-DEBUG] direct tool={tool_name} args={arguments} {elapsed_ms:.0f}ms content={payload}\n")
+    if _get_attr(result, "isError"):
+        raise RuntimeError(str(payload) or f"{tool_name} 執行失敗")
+    return payload
+
+def _opened_path(payload) -> str:
+    """解析 media_browser 的 'Opening: <path>' 回傳，取出實際開啟的路徑。"""
+    if isinstance(payload, dict):
+        return str(payload.get("opened") or payload.get("path") or "")
+    text = str(payload or "").strip()
+    if text.lower().startswith("opening:"):
+        return text.split(":", 1)[1].strip()
+    return ""
 
-    obj = _extract_last_json_line(text or "")
+# ---------------------- 小遊戲（open_in_browser；讀原始 JSON 判定） ----------------------
+async def open_puzzle_game(agent: Agent) -> bool:
+    """
+    直接呼叫 open_in_browser()（不經 LLM）。
+    成功判定：回傳內含可用欄位（例如 'temp_path' 為非空字串）。
+    """
+    obj = await call_tool_direct("open_in_browser", flow="game")
     if not isinstance(obj, dict):
         return False
 
@@ -259,101 +862,274 @@ async def open_puzzle_game(agent: Agent) -> bool:
     return isinstance(temp_path, str) and len(temp_path.strip()) > 0
 
 # ---------------------- 背景：情緒輪詢（MCP 專用） ----------------------
-EMOTION_MCP_PROMPT = (
-    "請務必呼叫『情緒偵測』的 MCP 工具取得最新結果，"
-    "不要沿用先前對話的任何答案，也不要猜測；"
-    "最後只回一行 JSON，例如：{\"emotion\":\"sad\",\"score\":0.87}\n"
-)
+def _emotion_alert_text(label: str, score) -> str:
+    return (
+        f"\n[情緒偵測] 目前情緒：{label}"
+        + (f"（信心 {float(score):.2f}）" if isinstance(score, (int, float)) else "")
+        + f"\n→ 你看起來狀態不太好，需要幫忙嗎？\n   同意請輸入 {' / '.join(CONSENT_KEYWORDS)}（拒絕：{' / '.join(CANCEL_KEYWORDS)}）\n"
+    )
 
-async def emotion_watcher(notify_queue: asyncio.Queue):
-    """MCP 專用情緒輪詢：每輪新建最小 Agent，避免脈絡殘留。"""
-    with open(AGENT_JSON_PATH, "r", encoding="utf-8") as f:
-        base_cfg = json.load(f)
-    mini_cfg = {"model": base_cfg["model"], "servers": base_cfg["servers"]}
+# 由 chat_loop 更新，供偵測排程器判斷使用者是否閒置 / 已在協助流程中
+USER_ACTIVITY = {"last_input": time.monotonic(), "in_session": False}
 
-    last_json = None  # 去重用（可取消）
+class DetectionScheduler:
+    """
+    依最近讀數、失敗次數與使用者狀態決定下一次情緒偵測的間隔：
+    - 負面情緒比例上升或偏高 → 縮短；主要情緒連續穩定且非負面 → 逐步拉長
+    - 使用者已同意協助（在流程中）或閒置 → 拉長
+    - 失敗 → 指數退避；每日攝影機/推論秒數用完 → 等到隔天
+    - 加上 ±jitter 比例的隨機抖動（避免與其他週期性工作對齊）後，再夾在 min_sec..max_sec 之間
+    - 只有 status=ok 的讀數會清除失敗退避；no_emotion 只計入每日秒數
+    決策理由在 LOG_EMOTION_DEBUG=1 時印出，方便調參。
+    """
 
-    while True:
-        try:
-            async with Agent(
-                model=mini_cfg["model"],
-                base_url="http://localhost:8000/api/",
-                servers=mini_cfg["servers"],
-                prompt=EMOTION_MCP_PROMPT
-            ) as probe:
-                await probe.load_tools()
+    def __init__(self, base_sec: float = POLL_INTERVAL_SEC, min_sec: float = POLL_MIN_SEC,
+                 max_sec: float = POLL_MAX_SEC, daily_budget_sec: float = DAILY_BUDGET_SEC,
+                 idle_after_sec: float = IDLE_AFTER_SEC, jitter: float = 0.1):
+        self.base_sec = base_sec
+        self.min_sec = min(min_sec, base_sec)
+        self.max_sec = max(max_sec, base_sec)
+        self.daily_budget_sec = daily_budget_sec
+        self.idle_after_sec = idle_after_sec
+        self.jitter = jitter
+        self.failures = 0
+        self.negatives = deque(maxlen=3)  # 最近幾次讀數的負面情緒機率總和
+        self.stable_streak = 0
+        self.last_label = None
+        self.budget_day = datetime.date.today()
+        self.budget_used = 0.0
+
+    def record(self, data: dict):
+        self._roll_budget_day()
+        self.budget_used += float(data.get("duration_sec") or 0.0)
+        if data.get("status") != "ok":
+            return  # no_emotion（沒拍到臉）不算成功，也不清除失敗退避
+        self.failures = 0
+        emotions = data.get("emotions") or {}
+        self.negatives.append(sum(float(emotions.get(e, 0.0)) for e in BAD_EMOTIONS))
+        label = (data.get("dominant_emotion") or "").lower()
+        stable = label == self.last_label and label not in BAD_EMOTIONS
+        self.stable_streak = self.stable_streak + 1 if stable else 0
+        self.last_label = label
+
+    def record_failure(self):
+        self.failures += 1
+
+    def _roll_budget_day(self):
+        today = datetime.date.today()
+        if today != self.budget_day:
+            self.budget_day = today
+            self.budget_used = 0.0
+
+    def next_delay(self) -> float:
+        self._roll_budget_day()
+        reasons = []
+        budget_exhausted = bool(self.daily_budget_sec) and self.budget_used >= self.daily_budget_sec
+        if budget_exhausted:
+            tomorrow = datetime.datetime.combine(self.budget_day + datetime.timedelta(days=1), datetime.time())
+            delay = max((tomorrow - datetime.datetime.now()).total_seconds(), self.min_sec)
+            reasons.append(f"daily budget used ({self.budget_used:.0f}s)")
+        elif self.failures:
+            delay = min(self.max_sec, self.min_sec * 2 ** (self.failures - 1))
+            reasons.append(f"backoff failures={self.failures}")
+        else:
+            delay = self.base_sec
+            rising = len(self.negatives) >= 2 and self.negatives[-1] - self.negatives[0] >= 0.1
+            if rising or (self.negatives and self.negatives[-1] >= 0.5):
+                delay *= 0.5
+                reasons.append(f"negative {'rising' if rising else 'high'} ({self.negatives[-1]:.2f})")
+            elif self.stable_streak >= 2:
+                delay *= 1.5 ** min(self.stable_streak - 1, 3)
+                reasons.append(f"stable x{self.stable_streak}")
+            idle_for = time.monotonic() - USER_ACTIVITY["last_input"]
+            # 協助中但已閒置（使用者離開、沒有輸入 /no）就不再視為「正在使用」
+            if USER_ACTIVITY["in_session"] and idle_for < self.idle_after_sec:
+                delay *= 3
+                reasons.append("in session")
+            if idle_for >= self.idle_after_sec:
+                delay *= 2
+                reasons.append(f"idle {idle_for:.0f}s")
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        if not budget_exhausted:
+            # 抖動之後才夾在上下限內，結果不會超出 min_sec..max_sec
+            delay = min(max(delay, self.min_sec), self.max_sec)
+        if LOG_EMOTION_DEBUG:
+            print(f"[DEBUG] scheduler next={delay:.0f}s reasons={reasons or ['base']}")
+        return delay
 
-                import time, random
-                nonce = f"{int(time.time())}-{random.randint(1000,9999)}"
-                q = f"請立即偵測情緒並依規定格式回覆。nonce={nonce}"
-                text = await run_agent_and_capture(probe, q)
+async def emotion_watcher(notify_queue: asyncio.Queue):
+    """
+    MCP 專用情緒輪詢：直接呼叫 emotion_detect 並讀取結構化欄位，不經 LLM。
+    使用自己的常駐連線（不與使用者操作搶同一個工具 Agent），間隔由 DetectionScheduler 決定。
+    """
+    base_cfg = _load_cfg()
+    pool = StatelessAgentPool({"model": base_cfg["model"], "servers": servers_for(base_cfg, "emotion")}, size=1)
+    scheduler = DetectionScheduler()
 
-            if LOG_EMOTION_DEBUG:
-                print(f"[DEBUG] nonce={nonce} text={text!r}")
+    last_key = None  # 去重用：(status, dominant_emotion)；duration_sec / frames 每次都不同，不能比整個結果
 
-            data = {}
+    try:
+        while True:
             try:
-                data = json.loads(text.strip())
-            except Exception:
-                m = re.search(r"\{.*\}", text or "", re.DOTALL)
-                if m:
-                    data = json.loads(m.group(0))
-
-            if LOG_EMOTION_DEBUG:
-                print(f"[DEBUG] parsed={data}")
-
-            if data and data != last_json:
-                last_json = data
-                label = (data.get("emotion") or "").lower()
-                score = data.get("score")
-                if label and label in BAD_EMOTIONS:
-                    msg = (
-                        f"\n[情緒偵測] 目前情緒：{label}"
-                        + (f"（信心 {float(score):.2f}）" if isinstance(score, (int, float)) else "")
-                        + f"\n→ 你看起來狀態不太好，需要幫忙嗎？\n   同意請輸入 {' / '.join(CONSENT_KEYWORDS)}（拒絕：{' / '.join(CANCEL_KEYWORDS)}）\n"
-                    )
-                    await notify_queue.put(msg)
+                data = await call_tool_direct("emotion_detect", pool=pool)
+                if LOG_EMOTION_DEBUG:
+                    print(f"[DEBUG] emotion_detect={data}")
+                if isinstance(data, dict):
+                    scheduler.record(data)
+                    key = (data.get("status"), (data.get("dominant_emotion") or "").lower())
+                    if key != last_key:
+                        last_key = key
+                        status, label = key
+                        if status == "ok" and label in BAD_EMOTIONS:
+                            await notify_queue.put(_emotion_alert_text(label, data.get("score")))
+
+            except Exception as e:
+                scheduler.record_failure()
+                # 連續失敗時只提示第一次，之後靜默退避
+                if scheduler.failures == 1:
+                    await notify_queue.put(f"\n[情緒偵測/MCP] 呼叫失敗：{e}\n")
+
+            await asyncio.sleep(scheduler.next_delay())
+    finally:
+        with contextlib.suppress(Exception):
+            await pool.close()
 
-        except Exception as e:
-            await notify_queue.put(f"\n[情緒偵測/MCP] 呼叫失敗：{e}\n")
+async def emotion_subscriber(notify_queue: asyncio.Queue):
+    """
+    訂閱情緒伺服器的 /events（SSE）推播：不建 Agent、不經 LLM，情緒一變化就送進 notify_queue。
+    - 主要情緒變成壞情緒時立即提醒；同一個壞情緒持續時，每 POLL_INTERVAL_SEC 秒最多再提醒一次
+    - 連線中斷時以指數退避（上限 EMOTION_PUSH_MAX_BACKOFF_SEC）重連，LOG_TOOL_DEBUG=1 時印出原因
+    - 連續 EMOTION_PUSH_MAX_FAILURES 次連不上，或伺服器不支援 /events（404）時，退回 emotion_watcher 輪詢
+    注意：有訂閱者時伺服器的背景監測會持續使用攝影機，因此預設關閉（EMOTION_PUSH=1 才啟用）。
+    """
+    import httpx
 
-        await asyncio.sleep(POLL_INTERVAL_SEC)
+    last_label = None
+    last_alert = 0.0
+    backoff = 1.0
+    failures = 0
+    while True:
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None)) as client:
+                async with client.stream("GET", EMOTION_EVENTS_URL) as resp:
+                    if resp.status_code == 404:
+                        if LOG_EMOTION_DEBUG:
+                            print("[DEBUG] /events not available, falling back to polling")
+                        return await emotion_watcher(notify_queue)
+                    resp.raise_for_status()
+                    backoff = 1.0
+                    failures = 0
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = json.loads(line[5:].strip())
+                        if LOG_EMOTION_DEBUG:
+                            print(f"[DEBUG] event={data}")
+                        if data.get("status") != "ok" or float(data.get("age_sec") or 0) > EMOTION_STALE_SEC:
+                            continue
+                        label = (data.get("dominant_emotion") or "").lower()
+                        now = time.monotonic()
+                        if label in BAD_EMOTIONS and (label != last_label or now - last_alert >= POLL_INTERVAL_SEC):
+                            last_alert = now
+                            await notify_queue.put(_emotion_alert_text(label, data.get("score")))
+                        last_label = label
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            failures += 1
+            if failures >= EMOTION_PUSH_MAX_FAILURES:
+                if LOG_TOOL_DEBUG or LOG_EMOTION_DEBUG:
+                    print(f"\n[TOOL-DEBUG] emotion events failed {failures} times ({e!r}); falling back to polling\n")
+                return await emotion_watcher(notify_queue)
+            if LOG_TOOL_DEBUG or LOG_EMOTION_DEBUG:
+                print(f"\n[TOOL-DEBUG] emotion events disconnected ({e!r}); retry {failures} in {backoff:.0f}s\n")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, EMOTION_PUSH_MAX_BACKOFF_SEC)
 
 # ---------------------- 與 Agent 的互動（隱藏工具輸出，支援工具除錯） ----------------------
-async def run_agent_chat(agent: Agent, user_text: str):
+class TokenStreamWriter:
     """
-    只輸出助理文字內容（串流/整段），完全隱藏工具呼叫與工具回覆。
+    串流文字的輸出緩衝：片段先累積，超過 STREAM_FLUSH_CHARS 字或距上次寫出 STREAM_FLUSH_SEC 秒才
+    一次寫出並 flush（停頓時由事件迴圈計時器補寫），訊息結束時呼叫 flush() 立即寫出。
+    每個 token 一次 write+flush 會讓 stdout 管線與 GUI 端被喚醒上千次。
     """
-    async for item in agent.run(user_text):
-        # 可選：工具除錯輸出
-        if LOG_TOOL_DEBUG and _get_attr(item, "role") == "tool":
-            tname = _get_attr(item, "name")
-            tcontent = _get_attr(item, "content")
-            print(f"\n[TOOL-DEBUG] tool={tname} content={tcontent}\n")
 
-        # 串流片段
-        choices = _get_attr(item, "choices")
-        if choices is not None:
-            for choice in choices or []:
-                delta = _get_attr(choice, "delta")
-                text = _get_attr(delta, "content")
-                if text:
-                    print(text, end="", flush=True)
-            continue
+    def __init__(self, out=None, window_sec: float = STREAM_FLUSH_SEC, max_chars: int = STREAM_FLUSH_CHARS):
+        self.out = out or sys.stdout
+        self.framed = out is None and _FRAME_OUT is not None  # JSONL 模式送出 token frame
+        self.window_sec = window_sec
+        self.max_chars = max_chars
+        self._parts = []
+        self._size = 0
+        self._timer = None
+
+    def write(self, text: str):
+        if not text:
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.max_chars or self.window_sec <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window_sec, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._parts:
+            if self.framed:
+                emit_frame("token", text="".join(self._parts))
+            else:
+                self.out.write("".join(self._parts))
+                self.out.flush()
+            self._parts.clear()
+            self._size = 0
 
-        # 完整助理訊息
-        if _get_attr(item, "role") == "assistant":
-            content = _get_attr(item, "content")
-            if isinstance(content, str) and content:
-                print(content, end="", flush=True)
-    print()
 
-async def run_agent_and_capture(agent: Agent, user_text: str) -> str:
+async def run_agent_chat(agent: Agent, user_text: str):
+    """
+    只輸出助理文字內容（串流/整段），完全隱藏工具呼叫與工具回覆。
+    串流片段經 TokenStreamWriter 合併後才寫出。
+    """
+    writer = TokenStreamWriter()
+    try:
+        async for item in agent.run(user_text):
+            # 可選：工具除錯輸出
+            if LOG_TOOL_DEBUG and _get_attr(item, "role") == "tool":
+                writer.flush()
+                tname = _get_attr(item, "name")
+                tcontent = _get_attr(item, "content")
+                print(f"\n[TOOL-DEBUG] tool={tname} content={tcontent}\n")
+
+            # 串流片段
+            choices = _get_attr(item, "choices")
+            if choices is not None:
+                for choice in choices or []:
+                    delta = _get_attr(choice, "delta")
+                    text = _get_attr(delta, "content")
+                    if text:
+                        writer.write(text)
+                continue
+
+            # 完整助理訊息
+            if _get_attr(item, "role") == "assistant":
+                content = _get_attr(item, "content")
+                if isinstance(content, str) and content:
+                    writer.write(content)
+    finally:
+        writer.flush()
+    ui_event("message_end", "")
+
+async def run_agent_and_capture(agent: Agent, user_text: str, tool_calls: Optional[list] = None) -> str:
     """
     不顯示任何工具訊息；不做串流印出，收集助理文字後回傳。
     用於需要檢查狀態碼或解析 JSON 的情境。
+    tool_calls 若給 list，會依序附加模型發出的工具呼叫 {"name", "arguments"}；
+    工具實際執行後，其回傳內容（tool 訊息，與 agent.messages 中相同）填入該筆的 "result"。
     """
     collected = []
+    pending_calls = {}  # 串流中的 tool_calls 以 index 分段送達，arguments 需要串接
     async for item in agent.run(user_text):
         # 可選：工具除錯輸出
         if LOG_TOOL_DEBUG and _get_attr(item, "role") == "tool":
@@ -368,8 +1144,33 @@ async def run_agent_and_capture(agent: Agent, user_text: str) -> str:
                 text = _get_attr(delta, "content")
                 if text:
                     collected.append(text)
+                if tool_calls is not None:
+                    for call in _get_attr(delta, "tool_calls") or []:
+                        fn = _get_attr(call, "function")
+                        slot = pending_calls.setdefault(_get_attr(call, "index", 0),
+                                                        {"id": None, "name": "", "arguments": ""})
+                        slot["id"] = slot["id"] or _get_attr(call, "id")
+                        slot["name"] = slot["name"] or (_get_attr(fn, "name") or "")
+                        slot["arguments"] += _get_attr(fn, "arguments") or ""
             continue
 
+        if _get_attr(item, "role") == "tool" and tool_calls is not None and pending_calls:
+            # 工具結果出現表示這一輪的 tool_calls 已完整，依 index 順序收下
+            for _, slot in sorted(pending_calls.items()):
+                try:
+                    arguments = json.loads(slot["arguments"] or "{}")
+                except Exception:
+                    arguments = None
+                tool_calls.append({"id": slot["id"], "name": slot["name"], "arguments": arguments})
+            pending_calls.clear()
+
+        if _get_attr(item, "role") == "tool" and tool_calls is not None:
+            call_id, tname = _get_attr(item, "tool_call_id"), _get_attr(item, "name")
+            for call in reversed(tool_calls):
+                if "result" not in call and (call["id"] == call_id if call_id else call["name"] == tname):
+                    call["result"] = _get_attr(item, "content")
+                    break
+
         if _get_attr(item, "role") == "assistant":
             content = _get_attr(item, "content")
             if isinstance(content, str) and content:
@@ -378,7 +1179,157 @@ async def run_agent_and_capture(agent: Agent, user_text: str) -> str:
     return "".join(collected).strip()
 
 # ---------------------- 音樂（play_song；讀原始 JSON 判定） ----------------------
+def _normalize_music_query(query: str) -> str:
+    """快取鍵：全形轉半形、小寫、合併空白、去掉頭尾標點（「周杰倫！」與「周杰倫」視為同一查詢）。"""
+    q = unicodedata.normalize("NFKC", query or "").lower()
+    q = " ".join(q.split())
+    return q.strip(" .,!?;:~、，。！？；：～「」『』\"'")
+
+
+# 開放式查詢（「隨便」「來點音樂」「放鬆的鋼琴」）每次都該讓 LLM 重新挑歌，不進快取；
+# 拿掉曲風/心情詞與虛詞後還剩下字的（歌手、歌名）才視為明確查詢
+_MUSIC_GENERIC_WORDS = re.compile(
+    r"lo-?fi|hip[- ]?hop|rap|鋼琴|放鬆|輕鬆|輕音樂|純音樂|背景音樂|抒情|搖滾|爵士|古典|電音|白噪音|療癒|安靜|"
+    r"開心|快樂|悲傷|難過|日文|韓文|英文|中文|日語|韓語|英語|國語|台語|流行",
+    re.I,
+)
+_MUSIC_FILLER_WORDS = re.compile(
+    r"隨便|都可以|什麼|一首|一些|一下|給我|播放|歌曲|音樂|想|要|聽|播|放|來|點|首|些|的|歌|好|我|吧|啦|呢|"
+    r"\b(any|random|some|something|songs?|music|please|play)\b",
+    re.I,
+)
+
+
+def _music_query_is_specific(query: str) -> bool:
+    """查詢是否指名歌手或歌名（而不是只有心情、曲風或「隨便」）。"""
+    rest = _MUSIC_GENERIC_WORDS.sub(" ", _normalize_music_query(query))
+    rest = _MUSIC_FILLER_WORDS.sub(" ", rest)
+    return bool(_normalize_music_query(rest))
+
+
+class MusicQueryCache:
+    """
+    正規化查詢 -> 已驗證成功的 play_song 參數（持久化 JSON，LRU + TTL）。
+    只存指名歌手/歌名的查詢（見 _music_query_is_specific）實際播放成功的參數；命中時直接呼叫 play_song，省下一整輪 LLM 推論。
+    命中/查詢次數也一起存檔，但 get() 不寫檔：隨下一次 put()/invalidate() 或結束時的 flush() 寫入。
+    LOG_METRICS=1 時每次查詢印出累計命中率。
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_sec: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.hits = 0
+        self.lookups = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        self.hits = int(data.get("hits", 0))
+        self.lookups = int(data.get("lookups", 0))
+        for key, entry in data.get("entries", []):  # 依最近使用順序（舊 -> 新）
+            self.entries[key] = entry
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with contextlib.suppress(Exception):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"hits": self.hits, "lookups": self.lookups, "entries": list(self.entries.items())},
+                          f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    def flush(self):
+        """把尚未寫檔的命中率計數與過期移除寫入快取檔。"""
+        if self._dirty:
+            self._save()
+
+    def get(self, query: str) -> Optional[dict]:
+        """回傳快取的 play_song 參數（過期視為未命中並移除）；同時更新命中率。"""
+        if self.max_entries <= 0:
+            return None
+        key = _normalize_music_query(query)
+        entry = self.entries.get(key)
+        if entry is not None and time.time() - entry["stored_at"] > self.ttl_sec:
+            del self.entries[key]
+            entry = None
+        self.lookups += 1
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        self._dirty = True
+        if LOG_METRICS:
+            log_metric(f"[METRIC] music_cache {'hit' if entry else 'miss'} "
+                  f"rate={self.hits / self.lookups:.0%} ({self.hits}/{self.lookups}) entries={len(self.entries)}")
+        return dict(entry["arguments"]) if entry else None
+
+    def put(self, query: str, arguments: dict):
+        if self.max_entries <= 0:
+            return
+        key = _normalize_music_query(query)
+        self.entries[key] = {"arguments": arguments, "stored_at": time.time()}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._save()
+
+    def invalidate(self, query: str):
+        if self.entries.pop(_normalize_music_query(query), None) is not None:
+            self._save()
+
+
+MUSIC_CACHE = MusicQueryCache(MUSIC_CACHE_PATH, MUSIC_CACHE_SIZE, MUSIC_CACHE_TTL_SEC)
+atexit.register(MUSIC_CACHE.flush)
+
+
+def _tool_message_payload(content):
+    """tool 訊息內容（字串）若是 JSON 就解析，否則回傳原字串。"""
+    if isinstance(content, str):
+        with contextlib.suppress(ValueError):
+            return json.loads(content)
+        return content.strip()
+    return content
+
+
+def _music_play_ok(obj) -> bool:
+    """play_song 結果是否代表播放成功：JSON 的 status ok/success 或 playing==true，或文字「Playing ...」。"""
+    if isinstance(obj, dict):
+        status = str(obj.get("status", "")).lower()
+        playing = obj.get("playing")
+        return status in {"ok", "success"} or (isinstance(playing, bool) and playing)
+    return isinstance(obj, str) and obj.startswith("Playing")
+
+
+async def _play_music_cached(query: str) -> bool:
+    """快取命中時直接呼叫 play_song；失敗就移除該筆並回 False（交給 LLM 路徑重新解析）。"""
+    if not _music_query_is_specific(query):
+        return False
+    arguments = MUSIC_CACHE.get(query)
+    if arguments is None:
+        return False
+    try:
+        payload = await call_tool_direct("play_song", arguments, flow="music")
+    except Exception as e:
+        payload = None
+        if LOG_TOOL_DEBUG:
+            print(f"\n[TOOL-DEBUG] cached play_song failed: {e}\n")
+    if _music_play_ok(payload):
+        print(payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False))
+        return True
+    MUSIC_CACHE.invalidate(query)
+    return False
+
+
 async def play_music(agent: Agent, query: str) -> bool:
+    if await _play_music_cached(query):
+        return True
+
     prompt = (
         MUSIC_PLAY_INSTRUCTION
         + "\n---\n"
@@ -387,20 +1338,21 @@ async def play_music(agent: Agent, query: str) -> bool:
         + "（若能更精準，請自行推斷並填入 track/artist；否則用 query）\n"
         + "（請勿沿用任何先前狀態，每次都要實際呼叫 play_song）\n"
     )
-    text = await tool_call_stateless(prompt)
+    calls: list = []
+    text = await tool_call_stateless(prompt, "music", tool_calls=calls)
 
     if text:
         print(text)
 
-    obj = _extract_last_json_line(text or "")
-    if obj is None:
+    # 以 play_song 工具實際回傳的內容判定成功，不採信 LLM 轉述的最後一行 JSON
+    played = [c for c in calls if c["name"] == "play_song" and _music_play_ok(_tool_message_payload(c.get("result")))]
+    if not played:
         return False
 
-    status = str(obj.get("status", "")).lower()
-    playing = obj.get("playing")
-    if status in {"ok", "success"} or (isinstance(playing, bool) and playing):
-        return True
-    return False
+    # 只快取明確查詢實際成功的那組參數（取最後一次成功的 play_song 呼叫）
+    if isinstance(played[-1]["arguments"], dict) and _music_query_is_specific(query):
+        MUSIC_CACHE.put(query, played[-1]["arguments"])
+    return True
 
 # ---------------------- 正念（list_media/open_index/open_media；不傳 dir） ----------------------
 def _parse_mind_arg(arg: str) -> Tuple[Optional[int], Optional[str]]:
@@ -430,48 +1382,17 @@ def _choose_by_keyword(candidates: list, keyword: str | None) -> Optional[str]:
 
 async def _mind_open_by_index(agent: Agent, index: int) -> bool:
     """
-    強制 LLM 只呼叫 open_index(kind='mp3', index=<index>)，最後一行回單行 JSON。
+    直接呼叫 open_index(kind='mp3', index=<index>)（不經 LLM）。
     """
-    prompt = (
-        """請只做一件事：呼叫 MCP 工具 open_index(kind='mp3', index="
-        + json.dumps(index)
-        + ").\n"
-        "不要呼叫任何其他工具，也不要多說話。\n"
-        "不得依賴先前對話的任何狀態；以工具回傳為準。\n"
-        "結束時，最後一行只輸出單行 JSON，鏡射工具結果，例如：\n"
-        '{"status":"ok","opened":"<檔名>","path":"<開啟的完整路徑或工具輸出>"}\n'
-        "若失敗：\n"
-        '{"status":"fail","reason":"<原因>"}\n"""
-    )
-    text = await tool_call_stateless(prompt)
-    if text:
-        print(text)
-
-    obj = _extract_last_json_line(text or "")
-    if not obj:
-        return False
-    status = str(obj.get("status", "")).lower()
-    opened = obj.get("opened") or obj.get("path")
-    return (status in {"ok", "success"}) or bool(opened)
+    opened = _opened_path(await call_tool_direct("open_index", {"kind": "mp3", "index": index}, flow="mind"))
+    return bool(opened)
 
 async def _mind_list_media(agent: Agent) -> list:
     """
-    強制呼叫 list_media()，並回傳 mp3 清單（list[str]）。
+    直接呼叫 list_media()，並回傳 mp3 清單（list[str]）。
     """
-    prompt = (
-        """請只做一件事：呼叫 MCP 工具 list_media() 取得預設資料夾清單。\n"
-        "不得依賴先前對話的任何狀態；以工具回傳為準。\n"
-        "最後一行只輸出單行 JSON，格式：\n"
-        '{"status":"ok","mp3": ["a.mp3","b.mp3", ...]}\n'
-        "若失敗：\n"
-        '{"status":"fail","reason":"<原因>"}\n"""
-    )
-    text = await tool_call_stateless(prompt)
-    if text:
-        print(text)
-
-    obj = _extract_last_json_line(text or "")
-    if not obj or str(obj.get("status", "")).lower() not in {"ok", "success"}:
+    obj = await call_tool_direct("list_media", flow="mind")
+    if not isinstance(obj, dict):
         return []
     mp3 = obj.get("mp3") or []
     # 僅保留字串，且去掉空白；不做任何補字或改名
@@ -483,16 +1404,37 @@ async def _mind_list_media(agent: Agent) -> list:
                 out.append(ss)
     return out
 
+async def _mind_search_and_open(keyword: str) -> Optional[bool]:
+    """
+    一次呼叫 search_media(open_best=True)：伺服器端模糊搜尋並開啟最符合的音檔。
+    回傳 None 表示沒有足夠符合的檔案（伺服器未開啟任何檔案）或伺服器沒有 search_media，由呼叫端改走舊流程。
+    """
+    try:
+        obj = await call_tool_direct("search_media", {"query": keyword, "limit": 1, "open_best": True}, flow="mind")
+    except RuntimeError as e:
+        if LOG_TOOL_DEBUG:
+            print(f"\n[TOOL-DEBUG] search_media unavailable: {e}\n")
+        return None
+    if not isinstance(obj, dict) or not obj.get("results") or not obj.get("opened"):
+        return None
+    return _same_name(obj["opened"], obj["results"][0]["name"])
+
 async def play_mind_audio(agent: Agent, index: Optional[int], keyword: Optional[str]) -> bool:
     """
     嚴格流程：
       - 有 index：直接 _mind_open_by_index(index)
-      - 否則：_mind_list_media() → Python 選檔 → 強制呼叫 open_media(name=<exact filename from list>)
+      - 有關鍵字：search_media 一次完成搜尋與開啟（伺服器端 n-gram 索引）
+      - 否則（或搜尋不到）：_mind_list_media() → Python 選檔 → 直接呼叫 open_media(name=<exact filename from list>)
     皆不傳 dir，使用 MCP 預設資料夾。
     """
     if index is not None:
         return await _mind_open_by_index(agent, index)
 
+    if keyword:
+        found = await _mind_search_and_open(keyword)
+        if found is not None:
+            return found
+
     # 先拿清單
     files = await _mind_list_media(agent)
     if not files:
@@ -503,45 +1445,20 @@ async def play_mind_audio(agent: Agent, index: Optional[int], keyword: Optional[
     if not target:
         return False
 
-    # 把「合法清單」與「目標檔名」一起告訴 LLM，要求逐字相同
-    valid_list_json = json.dumps(files, ensure_ascii=False)
-    target_json = json.dumps(target, ensure_ascii=False)
-
-    prompt = (
-        "你現在只能做一件事：呼叫 MCP 工具 open_media(name=<檔名>) 來開啟正念 mp3。\n"
-        "【嚴格規則】\n"
-        "1) name 參數必須從下方 valid_names（JSON 陣列）中擇一，且必須與該字串『逐字逐符號完全相同』；不得改名、不得加副檔名或路徑。\n"
-        "2) 這次請使用下方 target_name 指定的那一個檔名，不得替換為其他清單項目。\n"
-        "3) 呼叫完成後，最後一行只輸出單行 JSON，鏡射工具原始結果。\n"
-        "4) 如果工具回傳的 'opened' 或 'path' 對應的檔名與 target_name 不相同，請回傳：\n"
-        '   {\"status\":\"fail\",\"reason\":\"opened_mismatch\"}\n'
-        "-----\n"
-        f"valid_names = {valid_list_json}\n"
-        f"target_name = {target_json}\n"
-        "-----\n"
-        "請現在直接呼叫 open_media(name=target_name)。"
-    )
-
-    text = await tool_call_stateless(prompt)
-    if text:
-        print(text)
-
-    obj = _extract_last_json_line(text or "")
-    if not obj:
-        return False
-
-    status = str(obj.get("status", "")).lower()
-    opened = obj.get("opened") or obj.get("path") or ""
+    # 檔名已由 Python 從清單選定，直接呼叫 open_media(name=<exact filename>)
+    opened = _opened_path(await call_tool_direct("open_media", {"name": target}, flow="mind"))
 
     # 驗證：回傳的實際檔名必須與我們指定的 target 相同（比對 basename，不分大小寫）
-    if status in {"ok", "success"} and _same_name(opened, target):
-        return True
-
-    # 若 status 是 ok 但名稱不一致，視為失敗（避免 LLM/工具自行改名）
-    return False
+    return bool(opened) and _same_name(opened, target)
 
 
 # ---------------------- 主互動迴圈（仲裁者） ----------------------
+def _log_preload_failure(future: asyncio.Future):
+    """背景預載 huggingface_hub 失敗時立刻提示（不等到同意後才發現）。"""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"[系統] ⚠️ 預先載入 Agent 失敗：{future.exception()!r}")
+
+
 async def chat_loop(config: dict):
     """
     事件競態等候：
@@ -553,7 +1470,12 @@ async def chat_loop(config: dict):
       - CHAT：情緒諮商師聊天模式（不重覆顯示選單；/end 或 /menu 返回；自然語句可觸發功能）
     """
     notify_queue: asyncio.Queue[str] = asyncio.Queue()
-    watcher_task = asyncio.create_task(emotion_watcher(notify_queue))
+    # 使用者還在讀提示/輸入時，就先在背景載入 huggingface_hub
+    preload = asyncio.get_running_loop().run_in_executor(None, _fast_boot_agent_class)
+    preload.add_done_callback(_log_preload_failure)
+    watcher_task = asyncio.create_task(
+        emotion_subscriber(notify_queue) if EMOTION_PUSH else emotion_watcher(notify_queue)
+    )
 
     agent: Optional[Agent] = None
     pending_state = None  # None / EXPECTING_MUSIC_QUERY
@@ -563,16 +1485,30 @@ async def chat_loop(config: dict):
         nonlocal agent, mode
         if agent is not None:
             return
-        agent = Agent(
+        await preload  # 預載失敗時在這裡丟出原本的例外（例如缺少 huggingface_hub）
+        agent = new_agent(
             model=config["model"],
             base_url="http://localhost:8000/api/",
-            servers=config["servers"],
+            servers=servers_for(config, "chat"),
             prompt="You are an agent - please keep going until the user’s query is completely resolved."
         )
         await agent.__aenter__()
         await agent.load_tools()
+        apply_tool_allowlist(agent, config, "chat")
+        USER_ACTIVITY["in_session"] = True
         mode = "MENU"
-        print(MENU_TEXT)
+        ui_event("menu", MENU_TEXT)
+
+    async def end_session():
+        """關閉聊天 Agent 並離開協助流程（排程器恢復一般偵測間隔）。"""
+        nonlocal agent, pending_state, mode
+        USER_ACTIVITY["in_session"] = False
+        pending_state = None
+        mode = "MENU"
+        if agent is not None:
+            with contextlib.suppress(Exception):
+                await agent.__aexit__(None, None, None)
+            agent = None
 
     # 啟動時不印任何提示（保持靜默）
     input_task = asyncio.create_task(ainput(""))
@@ -588,13 +1524,14 @@ async def chat_loop(config: dict):
             # --- 情緒通知先到 ---
             if notify_task in done:
                 msg = notify_task.result()
-                print(msg, end="" if msg.endswith("\n") else "\n")
+                ui_event("emotion_alert", msg)
                 notify_task = asyncio.create_task(notify_queue.get())
 
             # --- 使用者輸入先到（或同時到） ---
             if input_task in done:
                 raw = (input_task.result() or "").strip()
                 input_task = asyncio.create_task(ainput(""))
+                USER_ACTIVITY["last_input"] = time.monotonic()
                 if not raw:
                     continue
 
@@ -605,18 +1542,24 @@ async def chat_loop(config: dict):
                     if lower in CONSENT_KEYWORDS:
                         await ensure_agent()
                     elif lower in CANCEL_KEYWORDS:
+                        USER_ACTIVITY["in_session"] = False
                         if not SILENT_BEFORE_CONSENT:
                             print("[系統] 已記錄你的選擇：暫不啟用協助。\n")
                     continue
 
+                # 已啟用後輸入 /no：結束協助，回到同意前的靜默狀態
+                if lower in CANCEL_KEYWORDS:
+                    await end_session()
+                    print("[系統] 已結束協助；之後偵測到情緒不佳時會再詢問你。\n")
+                    continue
+
                 # ===== 已啟用後：依模式分流 =====
                 if mode == "MENU":
+                    menu_intent = (INTENTS.match(raw, "menu") or (None,))[0]
+
                     # 0) 手動重設聊天 agent（不影響無記憶工具呼叫）
                     if lower == "/reset":
-                        if agent is not None:
-                            with contextlib.suppress(Exception):
-                                await agent.__aexit__(None, None, None)
-                            agent = None
+                        await end_session()
                         await ensure_agent()
                         print("[系統] 已重設對話狀態。\n")
                         continue
@@ -637,7 +1580,7 @@ async def chat_loop(config: dict):
                                           "  3) 換個關鍵字或指定另一首歌試試\n")
                             except Exception as e:
                                 print(f"\n[系統] ⚠️ 播放時發生錯誤：{e}\n")
-                            print(MENU_TEXT)
+                            ui_event("menu", MENU_TEXT)
                             pending_state = None
                         else:
                             print("你想聽什麼歌或什麼風格？（例如：周杰倫／放鬆鋼琴／Lo-fi）")
@@ -645,7 +1588,7 @@ async def chat_loop(config: dict):
                         continue
 
                     # 2) 紓壓小遊戲（瀏覽器拼圖；只允許 open_in_browser）
-                    if lower == "/game" or "玩紓壓" in raw:
+                    if lower == "/game" or menu_intent == "game":
                         try:
                             ok = await open_puzzle_game(agent)
                             if ok:
@@ -656,12 +1599,12 @@ async def chat_loop(config: dict):
                                     "  • 某些 MCP 用戶端可能會阻擋自動開窗，可改用 export_puzzle 手動複製（如需我再幫你改流程）\n")
                         except Exception as e:
                             print(f"\n[系統] ⚠️ 小遊戲開啟時發生錯誤：{e}\n")
-                        print(MENU_TEXT)
+                        ui_event("menu", MENU_TEXT)
                         pending_state = None
                         continue
 
                     # 3) 正念：播放本地音檔（支援 /mind 2 或 /mind 關鍵字）
-                    if lower.startswith("/mind") or "正念" in raw or "冥想" in raw:
+                    if lower.startswith("/mind") or menu_intent == "mind":
                         # 解析 /mind 後參數（可空、可數字、可關鍵字）
                         idx, kw = None, None
                         if lower.startswith("/mind"):
@@ -678,12 +1621,12 @@ async def chat_loop(config: dict):
                                       "  2) 試著改用索引（/mind 1）或不同關鍵字\n")
                         except Exception as e:
                             print(f"\n[系統] ⚠️ 正念音檔播放時發生錯誤：{e}\n")
-                        print(MENU_TEXT)
+                        ui_event("menu", MENU_TEXT)
                         pending_state = None
                         continue
 
                     # 4) 聊天模式（情緒諮商師）
-                    if lower == "/chat" or "聊天" in raw:
+                    if lower == "/chat" or menu_intent == "chat":
                         try:
                             await run_agent_chat(agent, CHAT_SYSTEM_INSTRUCTION)
                         except Exception as e:
@@ -706,7 +1649,7 @@ async def chat_loop(config: dict):
                                       "  3) 換個關鍵字或指定另一首歌試試\n")
                         except Exception as e:
                             print(f"\n[系統] ⚠️ 播放時發生錯誤：{e}\n")
-                        print(MENU_TEXT)
+                        ui_event("menu", MENU_TEXT)
                         pending_state = None
                         continue
 
@@ -715,13 +1658,13 @@ async def chat_loop(config: dict):
                         await run_agent_chat(agent, raw)
                     except Exception as e:
                         print(f"\n[Agent 錯誤] {e}\n")
-                    print(MENU_TEXT)
+                    ui_event("menu", MENU_TEXT)
 
                 elif mode == "CHAT":
                     # 聊天模式：不重覆顯示選單
                     if lower in {"/end", "/menu"}:
                         mode = "MENU"
-                        print(MENU_TEXT)
+                        ui_event("menu", MENU_TEXT)
                         continue
 
                     # 音樂等待關鍵字
@@ -789,16 +1732,17 @@ async def chat_loop(config: dict):
     except KeyboardInterrupt:
         print("\n手動中斷")
     finally:
-        for t in (input_task, notify_task):
+        # 被取消的 task 在 await 時丟出 CancelledError（BaseException），要一起吞掉，
+        # 否則後面的 end_session / close_tool_pool 不會執行，常駐的 MCP 伺服器也不會關閉
+        for t in (input_task, notify_task, watcher_task):
             t.cancel()
-        with contextlib.suppress(Exception):
-            await asyncio.gather(input_task, notify_task)
-        watcher_task.cancel()
-        with contextlib.suppress(Exception):
-            await watcher_task
-        if agent is not None:
-            with contextlib.suppress(Exception):
-                await agent.__aexit__(None, None, None)
+        for t in (input_task, notify_task, watcher_task):
+            with contextlib.suppress(Exception, asyncio.CancelledError):
+                await t
+        with contextlib.suppress(Exception, asyncio.CancelledError):
+            await end_session()
+        with contextlib.suppress(Exception, asyncio.CancelledError):
+            await close_tool_pool()
 
 # ---------------------- 進入點 ----------------------
 async def main():
@@ -809,6 +1753,8 @@ async def main():
     await chat_loop(config)
 
 if __name__ == "__main__":
+    if IPC_JSONL:
+        install_framed_stdout()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -1,13 +1,50 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
-from deepface import DeepFace
-import cv2
+from starlette.concurrency import run_in_threadpool
+import numpy as np
 import json
 import os
 import sys
+import time
+import threading
 pic_tool = 0
+
+
+# 與 servers/emotion_detection_mcp.py 共用同一份 lazy import 實作（servers/lazy_module.py）
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")))
+from lazy_module import LazyModule  # noqa: E402
+
+DeepFace = LazyModule("deepface", "DeepFace")
+cv2 = LazyModule("cv2")
 app = FastAPI()
 
+# 模型就緒狀態（由啟動時的暖機執行緒更新）
+readiness = {"status": "starting", "warmup_sec": None, "error": None}
+model_ready = threading.Event()
+
+def warm_up():
+    """在背景 import DeepFace / TensorFlow、載入情緒模型與人臉偵測器，並跑一次假推論。"""
+    started = time.monotonic()
+    try:
+        dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+        DeepFace.analyze(dummy, actions=['emotion'], enforce_detection=False)
+        readiness.update(status="ready", warmup_sec=round(time.monotonic() - started, 3), error=None)
+    except Exception as e:
+        readiness.update(status="error", error=str(e))
+    finally:
+        model_ready.set()
+
+@app.on_event("startup")
+def start_warm_up():
+    threading.Thread(target=warm_up, name="deepface-warmup", daemon=True).start()
+
+# 健康檢查 - 模型預載完成前回 503，啟動腳本可輪詢等待
+@app.get("/health")
+def health():
+    if readiness["status"] != "ready":
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
+
 # 載入設定檔（可選，如果你需要工具清單從 config.json）
 with open("config.json", "r", encoding="utf-8") as f:
     config = json.load(f)
@@ -31,12 +68,16 @@ async def mcp_handler(request: Request):
     tool = data.get("tool")
 
     if tool == "detect_emotion":
-        return detect_emotion()
+        # 拍照與 DeepFace 都會阻塞，放到執行緒池避免卡住事件迴圈
+        return await run_in_threadpool(detect_emotion)
 
     return JSONResponse(status_code=400, content={"error": f"Unknown tool: {tool}"})
 
 # 工具實作：拍照並分析情緒
 def detect_emotion():
+    # 第一次請求若早於暖機完成，先等模型載入（避免兩條執行緒同時建圖）
+    model_ready.wait(timeout=300)
+    start_time = time.time()
     cap = cv2.VideoCapture(0)
     ret, frame = cap.read()
     cap.release()
@@ -48,10 +89,13 @@ def detect_emotion():
         if pic_tool == 0:
             result = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False)
             emotion = result[0]['dominant_emotion']
+            # DeepFace 回傳百分比，統一換成 0~1
+            emotions = {k: round(float(v) / 100.0, 4) for k, v in result[0]['emotion'].items()}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"DeepFace 分析失敗: {str(e)}"})
 
-    return {"output": {"emotion": emotion}}
+    return {"output": {"emotion": emotion, "score": emotions.get(emotion), "emotions": emotions,
+                       "frames": 1, "duration_sec": round(time.time() - start_time, 2)}}
 
 if __name__ == "__main__":
     print("Starting MCP server...", file=sys.stderr)
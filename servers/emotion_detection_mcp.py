@@ -1,23 +1,200 @@
-from deepface import DeepFace
-import cv2
+import numpy as np
+import os
+import json
+import math
 import time
+import sqlite3
+import atexit
+import contextlib
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from fastmcp import FastMCP
+from lazy_module import LazyModule
+
+DeepFace = LazyModule("deepface", "DeepFace")
+cv2 = LazyModule("cv2")
 
 # 初始化 FastMCP
 mcp = FastMCP("emotion_detection")
 
+# 攝影機設定（可用環境變數覆寫）
+CAMERA_INDEX = int(os.environ.get("CAMERA_INDEX", "0"))
+CAMERA_WIDTH = int(os.environ.get("CAMERA_WIDTH", "640"))
+CAMERA_HEIGHT = int(os.environ.get("CAMERA_HEIGHT", "480"))
+CAMERA_FPS = float(os.environ.get("CAMERA_FPS", "15"))
+CAMERA_BUFFER_SIZE = int(os.environ.get("CAMERA_BUFFER_SIZE", "4"))
+CAMERA_IDLE_SEC = float(os.environ.get("CAMERA_IDLE_SEC", "30"))  # 多久沒人取影格就釋放攝影機
+
+# 推論工作執行緒數（同時進行的 DeepFace 推論上限）
+EMOTION_WORKERS = max(1, int(os.environ.get("EMOTION_WORKERS", "1")))
+# 等待模型暖機完成的最長秒數（emotion_detect 會先等暖機）
+WARMUP_TIMEOUT_SEC = float(os.environ.get("EMOTION_WARMUP_TIMEOUT_SEC", "300"))
+
+# 偵測視窗與提前結束（序列估計）設定
+DETECT_ADAPTIVE = os.environ.get("EMOTION_ADAPTIVE", "1") == "1"
+DETECT_MAX_SEC = float(os.environ.get("EMOTION_MAX_SEC", "10"))
+DETECT_MIN_FRAMES = int(os.environ.get("EMOTION_MIN_FRAMES", "3"))
+DETECT_MAX_FRAMES = int(os.environ.get("EMOTION_MAX_FRAMES", "0"))  # 0 = 不限，只看時間
+DETECT_MARGIN = float(os.environ.get("EMOTION_MARGIN", "15"))  # 第一名領先第二名的平均機率差（百分點）
+DETECT_STABLE_FRAMES = int(os.environ.get("EMOTION_STABLE_FRAMES", "2"))  # 差距需連續維持的影格數
+# 每次前向傳播一起分類的影格數（1 = 逐張 DeepFace.analyze）
+BATCH_SIZE = max(1, int(os.environ.get("EMOTION_BATCH_SIZE", "4")))
+DETECTOR_BACKEND = os.environ.get("EMOTION_DETECTOR", "opencv")
+# 人臉追蹤：每 K 張影格才跑一次完整人臉偵測，中間沿用（平滑後的）臉部框
+TRACK_DETECT_EVERY = max(1, int(os.environ.get("EMOTION_DETECT_EVERY", "5")))
+TRACK_MIN_SIMILARITY = float(os.environ.get("EMOTION_TRACK_MIN_SIM", "0.5"))  # 與上次臉部模板的相關係數下限
+TRACK_SMOOTHING = float(os.environ.get("EMOTION_TRACK_SMOOTHING", "0.6"))  # 新偵測框的權重（EMA）
+LOG_EMOTION_DEBUG = os.environ.get("LOG_EMOTION_DEBUG", "0") == "1"
+
+# 背景情緒監測（預設關閉）：低頻取樣，維持指數加權的情緒狀態供 emotion_snapshot 即時讀取
+MONITOR_ENABLED = os.environ.get("EMOTION_MONITOR", "0") == "1"
+MONITOR_INTERVAL_SEC = float(os.environ.get("EMOTION_MONITOR_INTERVAL_SEC", "5"))
+MONITOR_HALF_LIFE_SEC = float(os.environ.get("EMOTION_MONITOR_HALF_LIFE_SEC", "60"))
+MONITOR_DUTY = float(os.environ.get("EMOTION_MONITOR_DUTY", "0.05"))  # 擷取 + 推論時間佔牆鐘時間的上限比例
+# 背景監測每次取樣後攝影機保留幾秒（須小於取樣間隔；0 = 取到影格就釋放，兩次取樣之間不解碼影格）
+MONITOR_CAMERA_HOLD_SEC = float(os.environ.get("EMOTION_MONITOR_CAMERA_HOLD_SEC", "0"))
+# /events SSE 串流：沒有新事件時每隔多久送一次目前狀態（同時當作 keep-alive）
+EVENTS_HEARTBEAT_SEC = float(os.environ.get("EMOTION_EVENTS_HEARTBEAT_SEC", "60"))
+
+# 情緒時間序列資料庫（原始讀數 + 每分鐘/每小時彙總，各自保留期限）
+HISTORY_DB_PATH = os.environ.get(
+    "EMOTION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "emotion_history.db"))
+HISTORY_FLUSH_ROWS = int(os.environ.get("EMOTION_DB_FLUSH_ROWS", "20"))
+HISTORY_FLUSH_SEC = float(os.environ.get("EMOTION_DB_FLUSH_SEC", "60"))
+HISTORY_RETENTION_DAYS = {
+    "raw": float(os.environ.get("EMOTION_DB_RAW_DAYS", "2")),
+    "minute": float(os.environ.get("EMOTION_DB_MINUTE_DAYS", "14")),
+    "hour": float(os.environ.get("EMOTION_DB_HOUR_DAYS", "365")),
+}
+
+EMOTIONS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+class FrameGrabber:
+    """
+    背景執行緒持有攝影機，持續把最新的 (timestamp, frame) 放進小型環狀緩衝區。
+    第一次取影格時才開啟攝影機；超過 idle_sec 沒人取用就自動釋放，下次取用再重新開啟。
+    read(hold_sec=...) 可指定較短的保留時間（例如背景監測每次只取一張，取完就釋放）；
+    多個讀取者時以最晚的保留期限為準。
+    """
+
+    def __init__(self, index=CAMERA_INDEX, width=CAMERA_WIDTH, height=CAMERA_HEIGHT,
+                 fps=CAMERA_FPS, buffer_size=CAMERA_BUFFER_SIZE, idle_sec=CAMERA_IDLE_SEC):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.idle_sec = idle_sec
+        self._frames = deque(maxlen=max(1, buffer_size))
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = False
+        self._keep_until = 0.0  # 攝影機至少保持開啟到此時間（monotonic）
+        self._waiters = 0  # 正在等影格的讀取者；有人在等就不釋放
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.index)
+        if cap.isOpened():
+            if self.width:
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            if self.height:
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            if self.fps:
+                cap.set(cv2.CAP_PROP_FPS, self.fps)
+            # 盡量只保留最新影格，避免讀到驅動程式佇列裡的舊畫面
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _run(self):
+        cap = self._open()
+        try:
+            if not cap.isOpened():
+                print("無法開啟攝影機")
+                return
+            interval = 1.0 / self.fps if self.fps > 0 else 0.0
+            while not self._stop and (self._waiters or time.monotonic() < self._keep_until):
+                started = time.monotonic()
+                ret, frame = cap.read()
+                if ret:
+                    with self._cond:
+                        self._frames.append((time.time(), frame))
+                        self._cond.notify_all()
+                else:
+                    print("無法擷取影像")
+                # 依設定的 fps 節流，不讓背景執行緒吃滿 CPU
+                remaining = interval - (time.monotonic() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+        finally:
+            cap.release()
+            with self._cond:
+                self._frames.clear()
+                self._thread = None
+                self._cond.notify_all()
+
+    def _ensure_running(self, hold_sec):
+        # 呼叫端須持有 self._cond：登記等待者與啟動執行緒要在同一個臨界區，執行緒才不會一開就判定沒人用而結束
+        self._keep_until = max(self._keep_until, time.monotonic() + hold_sec)
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+            self._thread.start()
+
+    def read(self, newer_than=0.0, timeout=2.0, hold_sec=None):
+        """
+        取得比 newer_than 更新的最新影格，回傳 (timestamp, frame)；逾時或攝影機無法開啟時回傳 None。
+        hold_sec：取完後攝影機至少再保持開啟幾秒（預設 idle_sec）。
+        """
+        deadline = time.monotonic() + timeout
+        hold_sec = self.idle_sec if hold_sec is None else hold_sec
+        with self._cond:
+            self._waiters += 1
+            self._ensure_running(hold_sec)
+            restarted = False
+            try:
+                while True:
+                    if self._frames and self._frames[-1][0] > newer_than:
+                        return self._frames[-1]
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    if self._thread is None:
+                        # 執行緒剛好在我們登記前判定閒置而結束：重開一次；再結束代表攝影機打不開
+                        if restarted:
+                            return None
+                        restarted = True
+                        self._ensure_running(hold_sec)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=2.0)
+
+GRABBER = FrameGrabber()
+atexit.register(GRABBER.close)
+
+# 攝影機讀取與 DeepFace 推論都是阻塞呼叫，一律丟到專用執行緒池，
+# 讓 FastMCP 的事件迴圈在偵測期間仍能回應 ping / list_tools / 其他用戶端
+INFERENCE_POOL = ThreadPoolExecutor(max_workers=EMOTION_WORKERS, thread_name_prefix="emotion-infer")
+atexit.register(INFERENCE_POOL.shutdown, wait=False, cancel_futures=True)
+
+async def run_in_inference_pool(fn, *args):
+    """在推論執行緒池中執行阻塞函式並等待結果。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(INFERENCE_POOL, fn, *args)
+
 def capture_image():
-    """從攝影機擷取一張影像"""
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("無法開啟攝影機")
-        return None
-    ret, frame = cap.read()
-    cap.release()
-    if not ret:
-        print("無法擷取影像")
+    """從攝影機擷取一張影像（取背景執行緒緩衝區中的最新影格）"""
+    item = GRABBER.read()
+    if item is None:
         return None
-    return frame
+    return item[1]
 
 def analyze_emotion(image):
     """使用 DeepFace 進行情緒分析"""
@@ -28,31 +205,588 @@ def analyze_emotion(image):
         print(f"情緒分析過程中發生錯誤：{str(e)}")
         return None
 
+# ---- 批次推論：逐張偵測人臉，再把所有臉部一次送進情緒分類器 ----
+_emotion_model = None
+_batch_disabled = False
+
+def _get_emotion_model():
+    """取得 DeepFace 情緒分類器底層的 Keras 模型（相容新舊版 DeepFace API）。"""
+    global _emotion_model
+    if _emotion_model is None:
+        try:
+            from deepface.modules import modeling
+            client = modeling.build_model(task="facial_attribute", model_name="Emotion")
+        except (ImportError, TypeError):
+            client = DeepFace.build_model("Emotion")
+        _emotion_model = getattr(client, "model", client)
+    return _emotion_model
+
+def _largest_face(image):
+    """回傳影像中最大的一張臉（RGB、0~1 浮點）；偵測不到時退回整張影像。"""
+    faces = DeepFace.extract_faces(image, detector_backend=DETECTOR_BACKEND, enforce_detection=False, align=True)
+    if not faces:
+        return image[:, :, ::-1].astype(np.float32) / 255.0
+    best = max(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])
+    return best["face"]
+
+class FaceTracker:
+    """
+    偵測後追蹤：每 detect_every 張影格（或追蹤失敗時）才做完整人臉偵測，
+    其餘影格沿用上一個臉部框，並以 48x48 灰階模板的相關係數確認臉還在框內。
+    """
+
+    def __init__(self, detect_every=TRACK_DETECT_EVERY, min_similarity=TRACK_MIN_SIMILARITY,
+                 smoothing=TRACK_SMOOTHING):
+        self.detect_every = detect_every
+        self.min_similarity = min_similarity
+        self.smoothing = smoothing
+        self.box = None
+        self.template = None
+        self.since_detect = 0
+        self.frames = 0
+        self.detections = 0
+
+    @staticmethod
+    def _signature(crop):
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (48, 48)).astype(np.float32)
+
+    def _detect(self, frame, lost=False):
+        """完整人臉偵測；lost=True（追蹤遺失後重偵測）時直接採用新框，不與舊框做 EMA。"""
+        self.detections += 1
+        self.since_detect = 0
+        faces = DeepFace.extract_faces(frame, detector_backend=DETECTOR_BACKEND, enforce_detection=False, align=False)
+        faces = [f for f in faces if f.get("confidence", 1) and f["facial_area"]["w"] < frame.shape[1]]
+        if not faces:
+            self.box = None
+            self.template = None
+            return
+        area = max(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])["facial_area"]
+        box = np.array([area["x"], area["y"], area["w"], area["h"]], dtype=np.float32)
+        # 只在「一路追蹤成功後的定期重偵測」之間平滑；追蹤遺失時舊框已不可信，拉過去會讓裁切與模板都偏掉
+        if self.box is not None and not lost:
+            box = self.smoothing * box + (1.0 - self.smoothing) * self.box
+        self.box = box
+
+    def _crop(self, frame):
+        x, y, w, h = (int(round(v)) for v in self.box)
+        x, y = max(0, x), max(0, y)
+        crop = frame[y:y + h, x:x + w]
+        return crop if crop.size else None
+
+    def face(self, frame):
+        """回傳 frame 中臉部的 RGB 影像（0~1 浮點）；找不到臉時回傳整張影像。"""
+        self.frames += 1
+        crop = None
+        lost = False
+        if self.box is not None and self.since_detect < self.detect_every - 1:
+            crop = self._crop(frame)
+            if crop is not None and self.template is not None:
+                similarity = float(cv2.matchTemplate(self._signature(crop), self.template, cv2.TM_CCOEFF_NORMED)[0][0])
+                if similarity < self.min_similarity:
+                    crop = None  # 追蹤遺失 → 重新偵測
+            if crop is not None:
+                self.since_detect += 1
+            else:
+                lost = True
+        if crop is None:
+            self._detect(frame, lost=lost)
+            crop = self._crop(frame) if self.box is not None else None
+            self.template = self._signature(crop) if crop is not None else None
+        if crop is None:
+            crop = frame
+        return crop[:, :, ::-1].astype(np.float32) / 255.0
+
+    def detection_ratio(self):
+        return self.detections / self.frames if self.frames else 0.0
+
+def _to_emotion_input(face):
+    """把 RGB 臉部影像轉成情緒模型的輸入（48x48 灰階、0~1）。"""
+    face = np.asarray(face, dtype=np.float32)
+    if face.max() > 1.0:
+        face = face / 255.0
+    gray = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, (48, 48))
+
+def classify_faces(faces):
+    """把多張臉部影像一次前向傳播，回傳每張的情緒機率（百分比，與 DeepFace.analyze 相同格式）。"""
+    batch = np.stack([_to_emotion_input(face) for face in faces])[..., np.newaxis]
+    probs = _get_emotion_model().predict(batch, verbose=0)
+    results = []
+    for row in probs:
+        total = float(np.sum(row)) or 1.0
+        results.append({emotion: float(p) * 100.0 / total for emotion, p in zip(EMOTIONS, row)})
+    return results
+
+def analyze_emotions_batch(images, tracker=None):
+    """
+    批次情緒分析：回傳與 images 等長的列表，每項是該影格的情緒機率（失敗為 None）。
+    有 tracker 時以追蹤的臉部框裁切，省下大部分的人臉偵測。
+    批次路徑不相容目前的 DeepFace 版本時，自動退回逐張 analyze_emotion。
+    """
+    global _batch_disabled
+    if not images:
+        return []
+    if not _batch_disabled:
+        try:
+            find_face = tracker.face if tracker is not None else _largest_face
+            return classify_faces([find_face(image) for image in images])
+        except Exception as e:
+            _batch_disabled = True
+            print(f"批次情緒分析不可用，改為逐張分析：{str(e)}")
+    return [analyze_emotion(image) for image in images]
+
+# ---- 模型預載與就緒狀態 ----
+READINESS = {"status": "starting", "warmup_sec": None, "error": None}
+_warmup_future = None
+
+def warm_up():
+    """預先建立情緒模型與人臉偵測器，並跑一次假推論（TensorFlow 建圖、載入權重）。"""
+    started = time.monotonic()
+    try:
+        dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+        DeepFace.analyze(dummy, actions=['emotion'], enforce_detection=False)
+        if BATCH_SIZE > 1:
+            analyze_emotions_batch([dummy] * BATCH_SIZE)
+    except Exception as e:
+        READINESS.update(status="error", error=str(e))
+        print(f"模型暖機失敗：{str(e)}")
+        return
+    READINESS.update(status="ready", warmup_sec=round(time.monotonic() - started, 3), error=None)
+    print(f"模型暖機完成（{READINESS['warmup_sec']} 秒）")
+
+def start_warm_up():
+    """在推論執行緒池排入暖機工作（伺服器啟動時呼叫，重複呼叫不會重跑）。"""
+    global _warmup_future
+    if _warmup_future is None:
+        _warmup_future = INFERENCE_POOL.submit(warm_up)
+    return _warmup_future
+
+async def wait_until_ready():
+    """等待暖機完成；暖機失敗時不阻擋偵測（第一次推論會再嘗試載入模型）。"""
+    future = start_warm_up()
+    with contextlib.suppress(Exception):
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), WARMUP_TIMEOUT_SEC)
+
+@mcp.resource("emotion://ready", description="Emotion model readiness state", mime_type="application/json")
+def ready_resource() -> str:
+    """回傳模型就緒狀態（JSON 字串）。"""
+    return json.dumps(READINESS)
+
+@mcp.tool()
+def emotion_ready() -> dict:
+    """回傳情緒模型是否已完成預載（status: starting / ready / error）。"""
+    return dict(READINESS)
+
+class EmotionAverager:
+    """累加每張影格的情緒機率，提供平均分布與「第一名領先第二名」的差距。"""
+
+    def __init__(self):
+        self.sums = {emotion: 0.0 for emotion in EMOTIONS}
+        self.frame_count = 0
+
+    def add(self, emotions):
+        self.frame_count += 1
+        for emotion, prob in emotions.items():
+            self.sums[emotion] = self.sums.get(emotion, 0.0) + float(prob)
+
+    def averages(self):
+        if self.frame_count == 0:
+            return {}
+        return {emotion: total / self.frame_count for emotion, total in self.sums.items()}
+
+    def leader(self):
+        """回傳 (第一名情緒, 與第二名的差距)；沒有資料時回傳 (None, 0.0)。"""
+        ranked = sorted(self.averages().items(), key=lambda kv: kv[1], reverse=True)
+        if not ranked:
+            return None, 0.0
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return ranked[0][0], ranked[0][1] - runner_up
+
+class EmotionStore:
+    """
+    內嵌 SQLite 的情緒時間序列：
+    - record() 先放進記憶體緩衝，累積到 HISTORY_FLUSH_ROWS 筆或 HISTORY_FLUSH_SEC 秒才批次寫入
+    - 寫入時同步把這批讀數累加進 minute / hour 彙總表（存總和與筆數，可增量合併）
+    - 各表依保留天數定期清除，資料庫大小有上限
+    查詢一律讀彙總表，不掃描原始讀數。
+    """
+
+    RESOLUTIONS = {"minute": 60, "hour": 3600}
+    _PRUNE_EVERY_SEC = 3600
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._last_prune = 0.0
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            cols = ", ".join(f"{emotion} REAL NOT NULL" for emotion in EMOTIONS)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS raw (ts REAL NOT NULL, source TEXT NOT NULL, {cols})")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS raw_ts ON raw (ts)")
+            for table in self.RESOLUTIONS:
+                self._conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER PRIMARY KEY, n INTEGER NOT NULL, {cols})")
+            self._conn.commit()
+        return self._conn
+
+    def record(self, emotions, source="detect", ts=None):
+        row = (ts or time.time(), source, *(float(emotions.get(emotion, 0.0)) for emotion in EMOTIONS))
+        with self._lock:
+            self._pending.append(row)
+            due = (len(self._pending) >= HISTORY_FLUSH_ROWS
+                   or time.monotonic() - self._last_flush >= HISTORY_FLUSH_SEC)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return
+            db = self._db()
+            placeholders = ", ".join("?" * (2 + len(EMOTIONS)))
+            db.executemany(f"INSERT INTO raw VALUES ({placeholders})", rows)
+            for table, size in self.RESOLUTIONS.items():
+                buckets = {}
+                for row in rows:
+                    bucket = int(row[0] // size * size)
+                    acc = buckets.setdefault(bucket, [0] + [0.0] * len(EMOTIONS))
+                    acc[0] += 1
+                    for i, prob in enumerate(row[2:], start=1):
+                        acc[i] += prob
+                updates = ", ".join(["n = n + excluded.n"] + [f"{e} = {e} + excluded.{e}" for e in EMOTIONS])
+                db.executemany(
+                    f"INSERT INTO {table} VALUES (?, {', '.join('?' * (1 + len(EMOTIONS)))}) "
+                    f"ON CONFLICT(bucket) DO UPDATE SET {updates}",
+                    [(bucket, *acc) for bucket, acc in buckets.items()])
+            if time.monotonic() - self._last_prune >= self._PRUNE_EVERY_SEC:
+                self._last_prune = time.monotonic()
+                now = time.time()
+                db.execute("DELETE FROM raw WHERE ts < ?", (now - HISTORY_RETENTION_DAYS["raw"] * 86400,))
+                for table in self.RESOLUTIONS:
+                    db.execute(f"DELETE FROM {table} WHERE bucket < ?",
+                               (now - HISTORY_RETENTION_DAYS[table] * 86400,))
+            db.commit()
+
+    def history(self, seconds, resolution):
+        """回傳最近 seconds 秒、指定解析度（minute / hour）的平均情緒序列與整段平均。"""
+        self.flush()
+        since = time.time() - seconds
+        size = self.RESOLUTIONS[resolution]
+        with self._lock:
+            rows = self._db().execute(
+                f"SELECT bucket, n, {', '.join(EMOTIONS)} FROM {resolution} WHERE bucket >= ? ORDER BY bucket",
+                (int(since // size * size),)).fetchall()
+        points = []
+        totals = [0] + [0.0] * len(EMOTIONS)
+        for bucket, n, *sums in rows:
+            avg = {emotion: round(total / n / 100.0, 4) for emotion, total in zip(EMOTIONS, sums)}
+            points.append({"t": bucket, "n": n, "dominant_emotion": max(avg, key=avg.get), "emotions": avg})
+            totals[0] += n
+            for i, total in enumerate(sums, start=1):
+                totals[i] += total
+        summary = None
+        if totals[0]:
+            avg = {emotion: round(total / totals[0] / 100.0, 4) for emotion, total in zip(EMOTIONS, totals[1:])}
+            summary = {"n": totals[0], "dominant_emotion": max(avg, key=avg.get), "emotions": avg}
+        return {"resolution": resolution, "since": since, "points": points, "summary": summary}
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+STORE = EmotionStore()
+atexit.register(STORE.close)
+
+_RANGE_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+def _parse_range(text):
+    """把 '30m' / '24h' / '7d' / '4w' 轉成秒數。"""
+    text = str(text or "").strip().lower()
+    if text and text[-1] in _RANGE_UNITS and text[:-1].replace(".", "", 1).isdigit():
+        return float(text[:-1]) * _RANGE_UNITS[text[-1]]
+    raise ValueError("range must look like 30m, 24h, 7d or 4w")
+
+@mcp.tool()
+async def emotion_history(range: str = "24h", resolution: str = "auto") -> dict:
+    """
+    查詢情緒歷史（由每分鐘/每小時彙總表回答，查詢數週資料也很快）；機率為 0~1。
+    - range     : 時間範圍，例如 30m、24h、7d、4w
+    - resolution: minute、hour 或 auto（6 小時以內用 minute，其餘用 hour）
+    """
+    seconds = _parse_range(range)
+    if resolution == "auto":
+        resolution = "minute" if seconds <= 6 * 3600 else "hour"
+    if resolution not in EmotionStore.RESOLUTIONS:
+        raise ValueError("resolution must be 'minute', 'hour' or 'auto'")
+    # 查詢前會先寫入緩衝中的讀數，SQLite I/O 放到執行緒，不佔用事件迴圈
+    return await asyncio.to_thread(STORE.history, seconds, resolution)
+
+class EmotionMonitor:
+    """
+    指數加權（依時間衰減）的情緒狀態；背景執行緒低頻取樣更新，emotion_detect 的結果也會併入。
+    snapshot() 只讀取目前狀態，O(1)。
+    """
+
+    def __init__(self, interval_sec=MONITOR_INTERVAL_SEC, half_life_sec=MONITOR_HALF_LIFE_SEC, duty=MONITOR_DUTY):
+        self.interval_sec = interval_sec
+        self.tau = max(half_life_sec, 1e-6) / math.log(2)
+        self.duty = min(max(duty, 1e-3), 1.0)
+        self._lock = threading.Lock()
+        self._state = {}
+        self._updated_at = None
+        self._samples = 0
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._tracker = FaceTracker()
+
+    def observe(self, emotions, ts=None):
+        """併入一筆情緒分布（百分比）；主要情緒改變時推播 emotion_change 事件。"""
+        ts = ts or time.time()
+        with self._lock:
+            before = max(self._state, key=self._state.get) if self._state else None
+            if self._updated_at is None:
+                self._state = {emotion: float(emotions.get(emotion, 0.0)) for emotion in EMOTIONS}
+            else:
+                alpha = 1.0 - math.exp(-max(ts - self._updated_at, 0.0) / self.tau)
+                for emotion in EMOTIONS:
+                    prev = self._state.get(emotion, 0.0)
+                    self._state[emotion] = prev + alpha * (float(emotions.get(emotion, 0.0)) - prev)
+            self._updated_at = max(ts, self._updated_at or ts)
+            self._samples += 1
+            after = max(self._state, key=self._state.get)
+        if after != before:
+            publish_event("emotion_change", self.snapshot())
+
+    def snapshot(self):
+        with self._lock:
+            if self._updated_at is None:
+                return {"status": "no_data", "monitor": self.running}
+            dominant = max(self._state, key=self._state.get)
+            return {
+                "status": "ok",
+                "dominant_emotion": dominant,
+                "score": round(self._state[dominant] / 100.0, 4),
+                "emotions": {emotion: round(prob / 100.0, 4) for emotion, prob in self._state.items()},
+                "updated_at": self._updated_at,
+                "age_sec": round(time.time() - self._updated_at, 1),
+                "samples": self._samples,
+                "monitor": self.running,
+            }
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _sample(self):
+        # 保留時間比取樣間隔短：兩次取樣之間攝影機會被釋放，擷取成本也算進 duty 的忙碌時間
+        item = GRABBER.read(hold_sec=min(MONITOR_CAMERA_HOLD_SEC, self.interval_sec / 2))
+        if item is None:
+            return None
+        ts, frame = item
+        return ts, analyze_emotions_batch([frame], self._tracker)[0]
+
+    def _run(self):
+        while True:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                try:
+                    # 與 emotion_detect 共用推論執行緒池，維持推論併發上限
+                    item = INFERENCE_POOL.submit(self._sample).result()
+                    if item and item[1]:
+                        self.observe(item[1], item[0])
+                        STORE.record(item[1], source="monitor", ts=item[0])
+                except Exception as e:
+                    print(f"背景情緒監測失敗：{str(e)}")
+                busy = time.monotonic() - started
+                # 兩者取大：固定取樣間隔，以及讓推論時間不超過 duty 比例所需的休息時間
+                self._stop.wait(max(self.interval_sec - busy, busy * (1.0 / self.duty - 1.0)))
+            with self._thread_lock:
+                # 停止期間若又有人呼叫 start()，就繼續跑，不另開執行緒
+                if self._stop.is_set():
+                    self._thread = None
+                    return
+
+    def start(self):
+        with self._thread_lock:
+            self._stop.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="emotion-monitor", daemon=True)
+                self._thread.start()
+
+    def stop(self, wait=True):
+        with self._thread_lock:
+            self._stop.set()
+            thread = self._thread
+        if wait and thread is not None:
+            thread.join(timeout=2.0)
+
+MONITOR = EmotionMonitor()
+atexit.register(MONITOR.stop)
+
+# ---- 推播：/events（Server-Sent Events，與 MCP 共用 streamable-http 連接埠） ----
+_subscribers = set()  # {(loop, asyncio.Queue)}
+
+def _offer(queue, event):
+    """放進訂閱者佇列；佇列滿了就丟掉最舊的事件（慢的訂閱者只需要最新狀態）。"""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+def publish_event(kind, payload):
+    """從任何執行緒推播事件給所有 /events 訂閱者。"""
+    event = {"event": kind, **payload}
+    for loop, queue in list(_subscribers):
+        with contextlib.suppress(RuntimeError):  # 訂閱者的事件迴圈已關閉
+            loop.call_soon_threadsafe(_offer, queue, event)
+
+def _sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@mcp.custom_route("/events", methods=["GET"])
+async def emotion_events(request):
+    """
+    訂閱情緒狀態變化。連線期間會自動啟動背景監測（EMOTION_MONITOR=1 時則常駐），
+    最後一個訂閱者離開後停止；沒有新事件時每 EVENTS_HEARTBEAT_SEC 秒送一次 snapshot。
+    """
+    from starlette.responses import StreamingResponse
+
+    async def stream():
+        # 登記訂閱者與啟動監測都放在 try 裡：用戶端在串流開始前就斷線時什麼都不會登記，
+        # 一旦登記了，finally 一定會撤銷（否則訂閱者外洩、攝影機一直開著）
+        queue = asyncio.Queue(maxsize=16)
+        subscriber = (asyncio.get_running_loop(), queue)
+        try:
+            _subscribers.add(subscriber)
+            MONITOR.start()
+            current = MONITOR.snapshot()
+            if current.get("status") == "ok":
+                yield _sse({"event": "snapshot", **current})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    event = {"event": "snapshot", **MONITOR.snapshot()}
+                yield _sse(event)
+        finally:
+            _subscribers.discard(subscriber)
+            if not _subscribers and not MONITOR_ENABLED:
+                MONITOR.stop(wait=False)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@mcp.tool()
+def emotion_snapshot() -> dict:
+    """
+    立即回傳目前平滑後的情緒分布、主要情緒與資料新鮮度（age_sec），不做任何擷取或推論。
+    資料來自背景監測（EMOTION_MONITOR=1）與最近的 emotion_detect。
+    """
+    return MONITOR.snapshot()
+
+def _analyze_next_frames(last_ts, count, tracker=None):
+    """
+    取最多 count 張比 last_ts 新的影格並（批次）分析，回傳 (最後一張的 timestamp, [emotions, ...])；
+    一張都取不到時回傳 None。
+    """
+    frames = []
+    for _ in range(max(1, count)):
+        item = GRABBER.read(newer_than=last_ts)
+        if item is None:
+            break
+        last_ts, frame = item
+        frames.append(frame)
+    if not frames:
+        return None
+    if len(frames) == 1 and tracker is None:
+        return last_ts, [analyze_emotion(frames[0])]
+    return last_ts, analyze_emotions_batch(frames, tracker)
+
 @mcp.tool()
-async def emotion_detect() -> str:
-    """從攝影機擷取影像並進行情緒分析"""
-    duration = 10 
+async def emotion_detect(
+    max_seconds: float = DETECT_MAX_SEC,
+    min_frames: int = DETECT_MIN_FRAMES,
+    max_frames: int = DETECT_MAX_FRAMES,
+    margin: float = DETECT_MARGIN,
+    adaptive: bool = DETECT_ADAPTIVE,
+) -> dict:
+    """
+    從攝影機擷取影像並進行情緒分析，回傳結構化結果：
+    status（ok / no_emotion）、dominant_emotion、score（0~1）、emotions（各情緒平均機率，0~1）、
+    frames、duration_sec，以及給人看的 message。
+    - adaptive=True 時，至少 min_frames 張後，若第一名情緒的平均機率領先第二名 margin（百分點）
+      且連續維持數張影格，就提前結束；否則最多分析 max_seconds 秒或 max_frames 張（0 = 不限）。
+    """
+    await wait_until_ready()
     start_time = time.time()
-    emotion_counts = {emotion: 0 for emotion in ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]}
-    frame_count = 0
+    averager = EmotionAverager()
+    last_ts = 0.0
+    stable = 0
+    last_leader = None
+    tracker = FaceTracker()
 
-    while time.time() - start_time < duration:
-        frame = capture_image()
-        if frame is None:
+    done = False
+    while not done and time.time() - start_time < max_seconds:
+        count = BATCH_SIZE
+        if max_frames:
+            count = min(count, max_frames - averager.frame_count)
+            if count <= 0:
+                break
+        item = await run_in_inference_pool(_analyze_next_frames, last_ts, count, tracker)
+        if item is None:
             continue
+        last_ts, results = item
 
-        emotions = analyze_emotion(frame)
-        if emotions:
-            frame_count += 1
-            for emotion, prob in emotions.items():
-                emotion_counts[emotion] += prob
+        for emotions in results:
+            if not emotions:
+                continue
+            averager.add(emotions)
+            if adaptive and averager.frame_count >= max(1, min_frames):
+                leader, lead = averager.leader()
+                stable = stable + 1 if (lead >= margin and leader == last_leader) else int(lead >= margin)
+                last_leader = leader
+                if stable >= DETECT_STABLE_FRAMES:
+                    done = True
+                    break
 
+    elapsed = time.time() - start_time
+    frame_count = averager.frame_count
+    if LOG_EMOTION_DEBUG:
+        print(f"[DEBUG] face detection calls: {tracker.detections}/{tracker.frames} frames"
+              f" ({tracker.detection_ratio():.0%})")
+    result = {"frames": frame_count, "duration_sec": round(elapsed, 2)}
     if frame_count > 0:
-        avg_emotions = {emotion: prob / frame_count for emotion, prob in emotion_counts.items()}
+        avg_emotions = averager.averages()
+        MONITOR.observe(avg_emotions)
+        # record() 可能觸發批次寫入 SQLite，放到執行緒執行
+        await asyncio.to_thread(STORE.record, avg_emotions, "detect")
         dominant_emotion = max(avg_emotions, key=avg_emotions.get)
-        return (f"在 {duration} 秒內的主要情緒是：{dominant_emotion}，平均機率：{avg_emotions[dominant_emotion]:.2f}")
+        result.update(
+            status="ok",
+            dominant_emotion=dominant_emotion,
+            score=round(avg_emotions[dominant_emotion] / 100.0, 4),
+            emotions={emotion: round(prob / 100.0, 4) for emotion, prob in avg_emotions.items()},
+            message=f"在 {elapsed:.1f} 秒內（{frame_count} 張影格）的主要情緒是：{dominant_emotion}，平均機率：{avg_emotions[dominant_emotion]:.2f}",
+        )
     else:
-        return (f"在 {duration} 秒內未偵測到任何情緒")
+        result.update(status="no_emotion", dominant_emotion=None, score=None, emotions={},
+                      message=f"在 {elapsed:.1f} 秒內未偵測到任何情緒")
+    return result
 
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http", host="127.0.0.1", port=8001)
\ No newline at end of file
+    start_warm_up()
+    if MONITOR_ENABLED:
+        MONITOR.start()
+    mcp.run(transport="streamable-http", host="127.0.0.1", port=8001)
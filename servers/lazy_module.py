@@ -0,0 +1,26 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """第一次取用屬性時才 import（DeepFace 會連帶載入 TensorFlow，cv2 也要數百毫秒）。
+
+    伺服器啟動時由暖機工作在背景先觸發 import，list_tools、/manifest 等請求不必等它。
+    """
+
+    def __init__(self, module_name, attr=None):
+        self._module_name = module_name
+        self._attr = attr
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    module = importlib.import_module(self._module_name)
+                    self._target = getattr(module, self._attr) if self._attr else module
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
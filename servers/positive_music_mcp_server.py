@@ -1,5 +1,11 @@
 import os
+import json
+import math
+import time
+import unicodedata
+import struct
 import platform
+import threading
 import subprocess
 from fastmcp import FastMCP
 
@@ -9,6 +15,15 @@ mcp = FastMCP("media_browser")
 # 預設媒體資料夾（可用環境變數覆蓋）
 DEFAULT_MEDIA_DIR = os.environ.get("MEDIA_DIR", r"C:\Users\weare\emotion-music-agent\media")
 
+# 媒體索引（檔案清單 + 中繼資料）快取檔；資料夾 mtime 沒變時最多每隔 MEDIA_RESCAN_SEC 秒才重新 stat 每個檔案
+MEDIA_INDEX_PATH = os.environ.get(
+    "MEDIA_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media_index.json")
+)
+MEDIA_RESCAN_SEC = float(os.environ.get("MEDIA_RESCAN_SEC", "30"))
+MEDIA_KINDS = ("mp3", "mp4")
+# search_media(open_best=True) 只在第一名分數達到此門檻時才開啟；否則只回傳結果，讓用戶端改用清單挑選
+MEDIA_SEARCH_MIN_SCORE = float(os.environ.get("MEDIA_SEARCH_MIN_SCORE", "0.35"))
+
 def _resolve_dir(dir_path: str | None) -> str:
     """確認資料夾存在並回傳實際路徑。"""
     path = (dir_path or DEFAULT_MEDIA_DIR).strip('"').strip("'")
@@ -25,17 +40,377 @@ def _open_with_default_app(path: str) -> None:
     else:
         subprocess.Popen(["xdg-open", path])
 
+# ---------------------- 中繼資料解析（只讀檔頭，不需額外套件） ----------------------
+_MPEG_BITRATES = {  # (MPEG 版本是否為 1, layer) -> kbps 表（index 1..14）
+    (True, 1): [32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MPEG_BITRATES[(False, 3)] = _MPEG_BITRATES[(False, 2)]
+_MPEG_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+_ID3_FIELDS = {"TIT2": "title", "TPE1": "artist", "TALB": "album", "TCON": "genre",
+               "TT2": "title", "TP1": "artist", "TAL": "album", "TCO": "genre"}
+
+
+def _decode_text(data: bytes, encoding: int) -> str:
+    if encoding == 1:
+        text = data.decode("utf-16", "replace")
+    elif encoding == 2:
+        text = data.decode("utf-16-be", "replace")
+    elif encoding == 3:
+        text = data.decode("utf-8", "replace")
+    else:
+        # 規格是 ISO-8859-1，但台灣常見的舊檔其實是 Big5，先試 UTF-8 / Big5 再退回 latin-1
+        for codec in ("utf-8", "cp950"):
+            try:
+                text = data.decode(codec)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            text = data.decode("latin-1")
+    return text.replace("\x00", " ").strip()
+
+
+def _syncsafe(b: bytes) -> int:
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+
+def _read_id3v2(f, meta: dict) -> int:
+    """解析 ID3v2 的文字欄位，回傳標籤總長度（音訊資料從這裡開始）。"""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    version, flags = header[3], header[5]
+    size = _syncsafe(header[6:10]) + 10 + (10 if flags & 0x10 else 0)
+    body = f.read(size - 10)
+    pos = 0
+    if flags & 0x40 and version >= 3:  # extended header
+        ext = _syncsafe(body[0:4]) if version == 4 else struct.unpack(">I", body[0:4])[0] + 4
+        pos = ext
+    id_len, head_len = (3, 6) if version == 2 else (4, 10)
+    while pos + head_len <= len(body):
+        frame_id = body[pos:pos + id_len]
+        if not frame_id.strip(b"\x00"):
+            break
+        if version == 2:
+            frame_size = int.from_bytes(body[pos + 3:pos + 6], "big")
+        elif version == 4:
+            frame_size = _syncsafe(body[pos + 4:pos + 8])
+        else:
+            frame_size = struct.unpack(">I", body[pos + 4:pos + 8])[0]
+        data = body[pos + head_len:pos + head_len + frame_size]
+        pos += head_len + frame_size
+        field = _ID3_FIELDS.get(frame_id.decode("latin-1", "replace"))
+        if field and data and not meta.get(field):
+            meta[field] = _decode_text(data[1:], data[0])
+    return size
+
+
+def _read_id3v1(f) -> dict:
+    """檔尾 128 bytes 的 ID3v1 標籤（沒有就回空 dict）。"""
+    f.seek(-128, os.SEEK_END)
+    tag = f.read(128)
+    if tag[:3] != b"TAG":
+        return {}
+    fields = {}
+    for field, raw in (("title", tag[3:33]), ("artist", tag[33:63]), ("album", tag[63:93])):
+        value = _decode_text(raw.split(b"\x00", 1)[0], 0)
+        if value:
+            fields[field] = value
+    return fields
+
+
+def _read_mpeg_stream(f, offset: int, audio_end: int, meta: dict):
+    """從第一個 MPEG 音框取得位元率；有 Xing/Info 標頭（VBR）時用總音框數計算長度。"""
+    f.seek(offset)
+    chunk = f.read(64 * 1024)
+    for i in range(len(chunk) - 4):
+        if chunk[i] != 0xFF or (chunk[i + 1] & 0xE0) != 0xE0:
+            continue
+        b1, b2, b3 = chunk[i + 1], chunk[i + 2], chunk[i + 3]
+        version_bits, layer_bits = (b1 >> 3) & 0x03, (b1 >> 1) & 0x03
+        bitrate_idx, rate_idx = b2 >> 4, (b2 >> 2) & 0x03
+        if version_bits == 1 or layer_bits == 0 or bitrate_idx in (0, 15) or rate_idx == 3:
+            continue
+        mpeg1, layer = version_bits == 3, 4 - layer_bits
+        bitrate = _MPEG_BITRATES[(mpeg1, layer)][bitrate_idx - 1]
+        sample_rate = _MPEG_SAMPLE_RATES[version_bits][rate_idx]
+        samples_per_frame = 384 if layer == 1 else (1152 if mpeg1 or layer == 2 else 576)
+        duration = (audio_end - offset - i) * 8 / (bitrate * 1000)
+        mono = (b3 >> 6) == 3
+        side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+        xing = chunk[i + 4 + side_info:i + 4 + side_info + 12]
+        if xing[:4] in (b"Xing", b"Info") and struct.unpack(">I", xing[4:8])[0] & 0x01:
+            frames = struct.unpack(">I", xing[8:12])[0]
+            duration = frames * samples_per_frame / sample_rate
+            bitrate = round((audio_end - offset - i) * 8 / duration / 1000) if duration else bitrate
+        meta["bitrate_kbps"] = bitrate
+        meta["duration_sec"] = round(duration, 1)
+        return
+
+
+def _read_mp4_duration(f, file_size: int, meta: dict):
+    """在 moov/mvhd atom 讀取時間長度（timescale 與 duration）。"""
+    def atoms(start, end):
+        pos = start
+        while pos + 8 <= end:
+            f.seek(pos)
+            size, kind = struct.unpack(">I4s", f.read(8))
+            header = 8
+            if size == 1:
+                size, header = struct.unpack(">Q", f.read(8))[0], 16
+            elif size == 0:
+                size = end - pos
+            if size < header:
+                return
+            yield kind, pos + header, pos + size
+            pos += size
+
+    for kind, body, end in atoms(0, file_size):
+        if kind != b"moov":
+            continue
+        for sub, sub_body, _ in atoms(body, end):
+            if sub == b"mvhd":
+                f.seek(sub_body)
+                version = f.read(4)[0]
+                if version == 1:
+                    _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+                else:
+                    _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+                if timescale:
+                    meta["duration_sec"] = round(duration / timescale, 1)
+                return
+
+
+def read_media_metadata(path: str, kind: str, size: int) -> dict:
+    """讀取長度、位元率與 ID3 標題/演出者/專輯/類型；解析失敗的欄位略過。"""
+    meta: dict = {}
+    try:
+        with open(path, "rb") as f:
+            if kind == "mp3":
+                v1 = _read_id3v1(f) if size >= 128 else {}
+                f.seek(0)
+                offset = _read_id3v2(f, meta)
+                _read_mpeg_stream(f, offset, size - (128 if v1 else 0), meta)
+                for field, value in v1.items():  # ID3v2 優先，v1 只補缺的欄位
+                    meta.setdefault(field, value)
+            else:
+                _read_mp4_duration(f, size, meta)
+    except (OSError, struct.error, IndexError, ValueError, ZeroDivisionError):
+        pass
+    return meta
+
+
+# ---------------------- 媒體索引（持久化、依 mtime 增量更新） ----------------------
+class MediaIndex:
+    """
+    每個資料夾的 mp3/mp4 清單與中繼資料，存在 MEDIA_INDEX_PATH。
+    - 資料夾 mtime 沒變、且距上次掃描不到 MEDIA_RESCAN_SEC 秒：直接用記憶體中的清單（不碰磁碟）
+    - 否則 scandir 一次，只對新檔案或 size/mtime 變了的檔案重新解析檔頭
+    - 依字母排序的清單預先算好，open_index 是 O(1) 取值
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._folders: dict = {}   # folder -> {"dir_mtime", "files": {name: entry}}
+        self._sorted: dict = {}    # folder -> {"mp3": [name...], "mp4": [...]}
+        self._checked_at: dict = {}
+        self._versions: dict = {}  # folder -> 內容變動次數（給搜尋索引判斷是否要重建）
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._folders = json.load(f)
+        except Exception:
+            self._folders = {}
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._folders, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def _scan(self, folder: str, record: dict) -> bool:
+        files, changed = {}, False
+        old = record.get("files", {})
+        with os.scandir(folder) as it:
+            for entry in it:
+                kind = entry.name.rsplit(".", 1)[-1].lower() if "." in entry.name else ""
+                if kind not in MEDIA_KINDS or not entry.is_file():
+                    continue
+                st = entry.stat()
+                cached = old.get(entry.name)
+                if cached and cached["size"] == st.st_size and cached["mtime"] == st.st_mtime:
+                    files[entry.name] = cached
+                    continue
+                files[entry.name] = {"name": entry.name, "kind": kind, "size": st.st_size, "mtime": st.st_mtime,
+                                     **read_media_metadata(entry.path, kind, st.st_size)}
+                changed = True
+        changed = changed or set(files) != set(old)
+        record["files"] = files
+        return changed
+
+    def _ensure(self, folder: str) -> dict:
+        """確保索引是最新的（呼叫端需持有鎖），回傳 {"mp3": [...], "mp4": [...]}。"""
+        dir_mtime = os.stat(folder).st_mtime
+        record = self._folders.get(folder)
+        fresh = time.monotonic() - self._checked_at.get(folder, float("-inf")) < MEDIA_RESCAN_SEC
+        if record is not None and record.get("dir_mtime") == dir_mtime and fresh and folder in self._sorted:
+            return self._sorted[folder]
+        record = record or {}
+        changed = self._scan(folder, record) or record.get("dir_mtime") != dir_mtime
+        record["dir_mtime"] = dir_mtime
+        self._folders[folder] = record
+        self._checked_at[folder] = time.monotonic()
+        names = record["files"]
+        self._sorted[folder] = {kind: sorted(n for n, e in names.items() if e["kind"] == kind) for kind in MEDIA_KINDS}
+        if changed:
+            self._versions[folder] = self._versions.get(folder, 0) + 1
+            self._save()
+        return self._sorted[folder]
+
+    def names(self, folder: str, kind: str) -> list:
+        with self._lock:
+            return self._ensure(folder)[kind]
+
+    def entries(self, folder: str) -> list:
+        """所有檔案的中繼資料（mp3 在前，各自依檔名排序）。"""
+        return self.snapshot(folder)[1]
+
+    def snapshot(self, folder: str):
+        """回傳 (版本, 中繼資料清單)；版本只在內容變動時遞增。"""
+        with self._lock:
+            ordered = self._ensure(folder)
+            files = self._folders[folder]["files"]
+            entries = [dict(files[name]) for kind in MEDIA_KINDS for name in ordered[kind]]
+            return self._versions.get(folder, 0), entries
+
+
+MEDIA_INDEX = MediaIndex(MEDIA_INDEX_PATH)
+
+
+# ---------------------- 模糊搜尋（字元 n-gram 索引） ----------------------
+def _search_tokens(text: str) -> list:
+    """NFKC 正規化、轉小寫，標點/底線/空白都當分隔；回傳詞段。"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    cleaned = "".join(ch if unicodedata.category(ch)[0] in "LN" else " " for ch in text)
+    return cleaned.split()
+
+
+def _ngrams(text: str) -> set:
+    """
+    每個詞段取 2、3 字元 n-gram；非 ASCII（中日韓）字元另取單字，
+    讓「溫柔」、「女聲」這類部分字詞也能命中「溫柔女聲.mp3」。
+    """
+    grams = set()
+    for token in _search_tokens(text):
+        grams.update(ch for ch in token if not ch.isascii())
+        for n in (2, 3):
+            grams.update(token[i:i + n] for i in range(len(token) - n + 1))
+        if len(token) == 1 and token.isascii():
+            grams.add(token)
+    return grams
+
+
+class MediaSearchIndex:
+    """依 MediaIndex 的內容建立 n-gram 倒排索引（檔名主體 + ID3 標題/演出者/專輯/類型），內容變動才重建。"""
+
+    FIELDS = ("title", "artist", "album", "genre")
+
+    def __init__(self, media_index: MediaIndex):
+        self.media_index = media_index
+        self._lock = threading.Lock()
+        self._built: dict = {}  # folder -> (version, docs, postings, compact_texts)
+
+    def _build(self, entries: list):
+        postings: dict = {}
+        compact = []
+        for doc, entry in enumerate(entries):
+            text = " ".join([entry["name"].rsplit(".", 1)[0]] + [str(entry.get(f) or "") for f in self.FIELDS])
+            compact.append("".join(_search_tokens(text)))
+            for gram in _ngrams(text):
+                postings.setdefault(gram, []).append(doc)
+        return postings, compact
+
+    def search(self, folder: str, query: str, limit: int = 5, kind: str | None = None) -> list:
+        # 「秀逸男聲.mp3」這類含副檔名的查詢：索引只收檔名主體，副檔名的 n-gram 只會稀釋分數
+        stem, ext = os.path.splitext((query or "").strip())
+        if stem and ext[1:].lower() in MEDIA_KINDS:
+            query = stem
+        version, entries = self.media_index.snapshot(folder)
+        with self._lock:
+            built = self._built.get(folder)
+            if built is None or built[0] != version or len(built[1]) != len(entries):
+                built = (version, entries, *self._build(entries))
+                self._built[folder] = built
+        _, docs, postings, compact = built
+
+        grams = _ngrams(query)
+        if not grams:
+            return []
+        # 權重：較長的 n-gram、較少檔案含有的 n-gram 較有鑑別力
+        weights = {g: len(g) * math.log(1 + len(docs) / (1 + len(postings.get(g, ())))) for g in grams}
+        total = sum(weights.values()) or 1.0
+        scores: dict = {}
+        for gram in grams:
+            for doc in postings.get(gram, ()):
+                scores[doc] = scores.get(doc, 0.0) + weights[gram]
+        needle = "".join(_search_tokens(query))
+        ranked = []
+        for doc, score in scores.items():
+            entry = docs[doc]
+            if kind and entry["kind"] != kind:
+                continue
+            # 覆蓋率佔 80%；整段查詢連續出現在檔名/標籤中再加 20%
+            final = 0.8 * score / total + (0.2 if needle and needle in compact[doc] else 0.0)
+            ranked.append((round(final, 4), -len(compact[doc]), entry["name"], entry))
+        ranked.sort(key=lambda r: (-r[0], -r[1], r[2]))
+        return [{"name": entry["name"], "kind": entry["kind"], "score": score,
+                 **{f: entry[f] for f in self.FIELDS + ("duration_sec",) if entry.get(f)}}
+                for score, _, _, entry in ranked[:max(1, limit)]]
+
+
+MEDIA_SEARCH = MediaSearchIndex(MEDIA_INDEX)
+
 @mcp.tool
-def list_media(dir: str | None = None) -> dict:
+def list_media(dir: str | None = None, details: bool = False) -> dict:
     """
-    列出資料夾中的 mp3 / mp4 檔案。
+    列出資料夾中的 mp3 / mp4 檔案（來自媒體索引，依檔名排序）。
     - dir: 目標資料夾（可省略，使用預設 MEDIA_DIR）
+    - details: 為 True 時另外回傳 files：每個檔案的大小、修改時間、長度、位元率與 ID3 標題/演出者/專輯/類型
+    """
+    folder = _resolve_dir(dir)
+    result = {"directory": folder, "mp3": MEDIA_INDEX.names(folder, "mp3"), "mp4": MEDIA_INDEX.names(folder, "mp4")}
+    if details:
+        result["files"] = MEDIA_INDEX.entries(folder)
+    return result
+
+@mcp.tool
+def search_media(query: str, limit: int = 5, kind: str | None = "mp3", open_best: bool = False,
+                 dir: str | None = None) -> dict:
+    """
+    以關鍵字模糊搜尋媒體（檔名與 ID3 標題/演出者/專輯/類型；支援中文部分字詞）。
+    - query    : 關鍵字，例如「溫柔」、「ocean」
+    - limit    : 最多回傳幾筆（依分數排序，分數 0~1）
+    - kind     : 'mp3'、'mp4' 或 None（不限）
+    - open_best: 為 True 且第一名分數 >= MEDIA_SEARCH_MIN_SCORE 時，直接用預設播放器開啟它並回傳 opened；
+                 分數不足時 opened 為 null（結果照常回傳）
+    - dir      : 目標資料夾（可省略）
     """
     folder = _resolve_dir(dir)
-    names = os.listdir(folder)
-    mp3 = sorted([f for f in names if f.lower().endswith(".mp3")])
-    mp4 = sorted([f for f in names if f.lower().endswith(".mp4")])
-    return {"directory": folder, "mp3": mp3, "mp4": mp4}
+    if kind is not None and kind.lower() not in MEDIA_KINDS:
+        raise ValueError("kind must be 'mp3', 'mp4' or null")
+    results = MEDIA_SEARCH.search(folder, query, limit, kind.lower() if kind else None)
+    opened = None
+    if open_best and results and results[0]["score"] >= MEDIA_SEARCH_MIN_SCORE:
+        opened = os.path.join(folder, results[0]["name"])
+        _open_with_default_app(opened)
+    return {"directory": folder, "query": query, "results": results, "opened": opened}
 
 @mcp.tool
 def open_media(name: str, dir: str | None = None) -> str:
@@ -65,7 +440,7 @@ def open_index(kind: str, index: int, dir: str | None = None) -> str:
     if kind not in ("mp3", "mp4"):
         raise ValueError("kind must be 'mp3' or 'mp4'")
     folder = _resolve_dir(dir)
-    files = sorted([f for f in os.listdir(folder) if f.lower().endswith(f".{kind}")])
+    files = MEDIA_INDEX.names(folder, kind)
     if not files:
         raise ValueError(f"No .{kind} files found in {folder}")
     if not (1 <= index <= len(files)):
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+for sub in ("servers", "python-agent"):
+    sys.path.insert(0, os.path.join(ROOT, sub))
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+
+import emotion_detection_mcp as edm
+
+
+def test_monitor_update_smooths_toward_new_reading():
+    monitor = edm.EmotionMonitor(half_life_sec=10)
+    monitor.observe({"happy": 100.0}, ts=1000.0)
+    assert monitor.snapshot()["dominant_emotion"] == "happy"
+
+    # 經過一個半衰期，新讀數權重為一半
+    monitor.observe({"sad": 100.0}, ts=1010.0)
+    snap = monitor.snapshot()
+    assert snap["emotions"]["happy"] == 0.5
+    assert snap["emotions"]["sad"] == 0.5
+    assert snap["samples"] == 2
+
+
+def _tool_fn(tool):
+    # 舊版 FastMCP 的 @mcp.tool() 回傳 FunctionTool，原函式在 .fn
+    return getattr(tool, "fn", tool)
+
+
+def test_store_rollup_is_queryable_through_emotion_history(tmp_path, monkeypatch):
+    store = edm.EmotionStore(path=str(tmp_path / "history.db"))
+    monkeypatch.setattr(edm, "STORE", store)
+    now = edm.time.time()
+    store.record({"happy": 80.0, "neutral": 20.0}, ts=now - 30)
+    store.record({"happy": 40.0, "neutral": 60.0}, ts=now - 20)
+
+    history = asyncio.run(_tool_fn(edm.emotion_history)("1h", "hour"))
+    summary = history["summary"]
+    assert history["resolution"] == "hour"
+    assert summary["n"] == 2
+    assert summary["emotions"]["happy"] == 0.6
+    assert summary["dominant_emotion"] == "happy"
+    assert sum(point["n"] for point in history["points"]) == 2
+    store.close()
+
+
+def test_list_tools_answers_while_detection_runs(tmp_path, monkeypatch):
+    from fastmcp import Client
+
+    def slow_frames(last_ts, count, tracker=None):
+        time.sleep(0.3)  # 模擬阻塞的擷取 + 推論
+        return last_ts + 1, [{"happy": 90.0, "neutral": 10.0}]
+
+    async def ready():
+        return None
+
+    monkeypatch.setattr(edm, "_analyze_next_frames", slow_frames)
+    monkeypatch.setattr(edm, "wait_until_ready", ready)
+    monkeypatch.setattr(edm, "STORE", edm.EmotionStore(path=str(tmp_path / "history.db")))
+
+    async def scenario():
+        async with Client(edm.mcp) as client:
+            started = time.monotonic()
+            detect = asyncio.create_task(
+                client.call_tool("emotion_detect", {"max_seconds": 1.0, "adaptive": False}))
+            await asyncio.sleep(0.1)
+            tools = await client.list_tools()
+            listed_at = time.monotonic() - started
+            assert not detect.done()
+            result = await detect
+            detected_at = time.monotonic() - started
+        return tools, listed_at, result, detected_at
+
+    tools, listed_at, result, detected_at = asyncio.run(scenario())
+    assert "emotion_detect" in {tool.name for tool in tools}
+    # 偵測要跑滿 max_seconds（約 1 秒以上）；list_tools 不必等它，也不必等任何一次阻塞的推論
+    assert detected_at >= 1.0
+    assert listed_at < 0.3
+    assert result.structured_content["status"] == "ok"
+
+
+class _FakeDeepFace:
+    def __init__(self, area):
+        self.area = area
+
+    def extract_faces(self, frame, **kwargs):
+        return [{"confidence": 0.99, "facial_area": dict(self.area)}]
+
+
+def test_tracker_redetection_after_loss_is_not_smoothed(monkeypatch):
+    frame = edm.np.zeros((480, 640, 3), dtype=edm.np.uint8)
+    tracker = edm.FaceTracker(smoothing=0.5)
+    tracker.box = edm.np.array([0, 0, 100, 100], dtype=edm.np.float32)
+    monkeypatch.setattr(edm, "DeepFace", _FakeDeepFace({"x": 300, "y": 200, "w": 120, "h": 120}))
+
+    tracker._detect(frame)  # 定期重偵測：與前一框平滑
+    assert tracker.box.tolist() == [150, 100, 110, 110]
+
+    tracker._detect(frame, lost=True)  # 追蹤遺失：直接採用新框
+    assert tracker.box.tolist() == [300, 200, 120, 120]
+
+
+class _FakeCapture:
+    reads = 0
+
+    def __init__(self, index):
+        pass
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        pass
+
+    def read(self):
+        _FakeCapture.reads += 1
+        return True, edm.np.zeros((4, 4, 3), dtype=edm.np.uint8)
+
+    def release(self):
+        pass
+
+
+class _FakeCv2:
+    VideoCapture = _FakeCapture
+    CAP_PROP_FRAME_WIDTH = CAP_PROP_FRAME_HEIGHT = CAP_PROP_FPS = CAP_PROP_BUFFERSIZE = 0
+
+
+def test_grabber_releases_camera_after_short_hold(monkeypatch):
+    monkeypatch.setattr(edm, "cv2", _FakeCv2)
+    _FakeCapture.reads = 0
+    grabber = edm.FrameGrabber(fps=50, idle_sec=30)
+
+    assert grabber.read(hold_sec=0) is not None
+    time.sleep(0.3)
+    assert grabber._thread is None  # 取樣後立即釋放，兩次取樣之間不再解碼影格
+    reads = _FakeCapture.reads
+    time.sleep(0.2)
+    assert _FakeCapture.reads == reads <= 2
+
+    assert grabber.read() is not None  # 一般讀取仍保留 idle_sec
+    time.sleep(0.2)
+    assert grabber._thread is not None
+    grabber.close()
+
+
+def test_events_stream_registers_only_while_iterating(monkeypatch):
+    class FakeMonitor:
+        running = False
+
+        def start(self):
+            self.running = True
+
+        def stop(self, wait=True):
+            self.running = False
+
+        def snapshot(self):
+            return {"status": "ok", "dominant_emotion": "happy"}
+
+    monitor = FakeMonitor()
+    monkeypatch.setattr(edm, "MONITOR", monitor)
+    monkeypatch.setattr(edm, "MONITOR_ENABLED", False)
+
+    async def scenario():
+        response = await edm.emotion_events(None)
+        # 用戶端在串流開始前就斷線：什麼都沒登記，監測也沒啟動
+        assert not edm._subscribers and not monitor.running
+
+        stream = response.body_iterator
+        first = await stream.__anext__()
+        assert "snapshot" in first and len(edm._subscribers) == 1 and monitor.running
+        await stream.aclose()
+        assert not edm._subscribers and not monitor.running
+
+    asyncio.run(scenario())
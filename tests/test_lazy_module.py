@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from lazy_module import LazyModule
+
+
+def test_import_is_deferred_until_first_attribute(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    colorsys = LazyModule("colorsys")
+    assert "colorsys" not in sys.modules
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert "colorsys" in sys.modules
+
+
+def test_attr_resolves_to_module_member():
+    dumps = LazyModule("json", "dumps")
+    assert dumps.__name__ == "dumps"
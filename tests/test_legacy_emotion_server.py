@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import os
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+MAIN = os.path.join(ROOT, "servers", "emotion_detect_mcp_server-main", "emotion_detect_mcp_server-main", "main.py")
+
+
+def _load_legacy():
+    # main.py 在 import 時讀取同目錄的 config.json
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(MAIN))
+    try:
+        spec = importlib.util.spec_from_file_location("legacy_emotion_main", MAIN)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        os.chdir(cwd)
+
+
+legacy = _load_legacy()
+
+
+class _FakeCapture:
+    def __init__(self, index):
+        pass
+
+    def read(self):
+        return True, object()
+
+    def release(self):
+        pass
+
+
+class _FakeCv2:
+    VideoCapture = _FakeCapture
+
+
+class _FakeDeepFace:
+    @staticmethod
+    def analyze(frame, **kwargs):
+        return [{"dominant_emotion": "happy", "emotion": {"happy": 80.0, "neutral": 20.0}}]
+
+
+def test_detect_emotion_reports_frames_and_duration(monkeypatch):
+    monkeypatch.setattr(legacy, "cv2", _FakeCv2)
+    monkeypatch.setattr(legacy, "DeepFace", _FakeDeepFace)
+    legacy.model_ready.set()
+
+    output = legacy.detect_emotion()["output"]
+    assert output["emotion"] == "happy"
+    assert output["frames"] == 1
+    assert output["duration_sec"] >= 0
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import positive_music_mcp_server as pms
+
+NAMES = ["溫柔女聲.mp3", "秀逸男聲.mp3", "穩健男聲.mp3", "自在女聲.mp3"]
+
+
+def _tool_fn(tool):
+    # 舊版 FastMCP 的 @mcp.tool 回傳 FunctionTool，原函式在 .fn
+    return getattr(tool, "fn", tool)
+
+
+@pytest.fixture
+def media(tmp_path, monkeypatch):
+    folder = tmp_path / "media"
+    folder.mkdir()
+    for name in NAMES:
+        (folder / name).write_bytes(b"\x00" * 64)
+    index = pms.MediaIndex(str(tmp_path / "media_index.json"))
+    monkeypatch.setattr(pms, "MEDIA_INDEX", index)
+    monkeypatch.setattr(pms, "MEDIA_SEARCH", pms.MediaSearchIndex(index))
+    opened = []
+    monkeypatch.setattr(pms, "_open_with_default_app", opened.append)
+    return str(folder), opened
+
+
+def test_query_with_extension_matches_its_own_file(media):
+    folder, _ = media
+    for query in ("秀逸男聲.mp3", "秀逸男聲.MP3", "秀逸男聲"):
+        best = pms.MEDIA_SEARCH.search(folder, query, 1)[0]
+        assert (best["name"], best["score"]) == ("秀逸男聲.mp3", 1.0)
+
+
+def test_open_best_skips_weak_matches(media):
+    folder, opened = media
+    search_media = _tool_fn(pms.search_media)
+
+    weak = search_media("自然", open_best=True, dir=folder)
+    assert weak["results"] and weak["results"][0]["score"] < pms.MEDIA_SEARCH_MIN_SCORE
+    assert weak["opened"] is None
+    assert opened == []
+
+    strong = search_media("溫柔", open_best=True, dir=folder)
+    assert strong["opened"].endswith("溫柔女聲.mp3")
+    assert opened == [strong["opened"]]
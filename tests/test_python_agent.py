@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+import io
+import sys
+import json
+import asyncio
+import threading
+import contextlib
+
+import python_agent as pa
+
+
+def _ok(label="neutral", duration=2.0):
+    return {"status": "ok", "dominant_emotion": label, "emotions": {label: 0.9}, "duration_sec": duration}
+
+
+def test_scheduler_jitter_never_exceeds_bounds(monkeypatch):
+    monkeypatch.setitem(pa.USER_ACTIVITY, "in_session", True)
+    scheduler = pa.DetectionScheduler(base_sec=600, min_sec=60, max_sec=1000, jitter=0.1)
+    monkeypatch.setattr(pa.random, "uniform", lambda a, b: b)
+    assert scheduler.next_delay() == 1000  # 600 * 3 * 1.1 → 夾到上限
+    monkeypatch.setattr(pa.random, "uniform", lambda a, b: a)
+    scheduler.record_failure()
+    assert scheduler.next_delay() == 60  # 60 * 0.9 → 夾到下限
+
+
+def test_scheduler_ignores_stale_session_after_inactivity(monkeypatch):
+    monkeypatch.setattr(pa.random, "uniform", lambda a, b: 0.0)
+    monkeypatch.setitem(pa.USER_ACTIVITY, "in_session", True)
+    scheduler = pa.DetectionScheduler(base_sec=100, min_sec=10, max_sec=10000, idle_after_sec=900)
+    monkeypatch.setitem(pa.USER_ACTIVITY, "last_input", pa.time.monotonic())
+    assert scheduler.next_delay() == 300  # 協助中：間隔拉長
+    monkeypatch.setitem(pa.USER_ACTIVITY, "last_input", pa.time.monotonic() - 1000)
+    assert scheduler.next_delay() == 200  # 沒輸入 /no 就離開：只算閒置
+
+
+def test_scheduler_only_ok_clears_failure_backoff():
+    scheduler = pa.DetectionScheduler(base_sec=600, min_sec=60, max_sec=3600)
+    scheduler.record_failure()
+    scheduler.record_failure()
+    scheduler.record({"status": "no_emotion", "duration_sec": 10.0, "emotions": {}})
+    assert scheduler.failures == 2
+    assert scheduler.budget_used == 10.0
+    scheduler.record(_ok())
+    assert scheduler.failures == 0
+
+
+def test_watcher_alerts_once_per_dominant_emotion_change(monkeypatch):
+    readings = [
+        {**_ok("sad", 1.2), "frames": 4},
+        {**_ok("sad", 3.4), "frames": 9},  # 只有 duration_sec / frames 不同 → 不重複提醒
+        {**_ok("neutral"), "frames": 5},
+        {**_ok("sad", 2.0), "frames": 6},
+    ]
+
+    async def fake_call(tool_name, arguments=None, flow="chat", pool=None):
+        if not readings:
+            raise asyncio.CancelledError
+        return readings.pop(0)
+
+    monkeypatch.setattr(pa, "call_tool_direct", fake_call)
+    monkeypatch.setattr(pa.DetectionScheduler, "next_delay", lambda self: 0)
+
+    async def scenario():
+        queue = asyncio.Queue()
+        with contextlib.suppress(asyncio.CancelledError):
+            await pa.emotion_watcher(queue)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    alerts = asyncio.run(scenario())
+    assert len(alerts) == 2
+    assert all("sad" in alert for alert in alerts)
+
+
+def test_subscriber_falls_back_to_polling_after_repeated_failures(monkeypatch, capsys):
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def fast_sleep(sec):
+        sleeps.append(sec)
+        await real_sleep(0)
+
+    async def fake_watcher(queue):
+        return "polling"
+
+    monkeypatch.setattr(pa, "EMOTION_EVENTS_URL", "http://127.0.0.1:9/events")  # 沒有人在聽的 port
+    monkeypatch.setattr(pa, "EMOTION_PUSH_MAX_FAILURES", 4)
+    monkeypatch.setattr(pa, "LOG_TOOL_DEBUG", True)
+    monkeypatch.setattr(pa, "emotion_watcher", fake_watcher)
+    monkeypatch.setattr(pa.asyncio, "sleep", fast_sleep)
+
+    assert asyncio.run(pa.emotion_subscriber(asyncio.Queue())) == "polling"
+    assert sleeps == [1.0, 2.0, 4.0]
+    assert "falling back to polling" in capsys.readouterr().out
+
+
+def test_music_cache_lookups_do_not_write(tmp_path):
+    path = tmp_path / "music.json"
+    cache = pa.MusicQueryCache(str(path), max_entries=10, ttl_sec=3600)
+    cache.put("周杰倫", {"song_name": "晴天", "artist_name": "周杰倫"})
+    written = path.stat().st_mtime_ns, path.read_text(encoding="utf-8")
+    for _ in range(5):
+        assert cache.get("周杰倫！")["song_name"] == "晴天"
+        assert cache.get("五月天") is None
+    assert (path.stat().st_mtime_ns, path.read_text(encoding="utf-8")) == written
+
+    cache.flush()
+    reloaded = pa.MusicQueryCache(str(path), max_entries=10, ttl_sec=3600)
+    assert (reloaded.hits, reloaded.lookups) == (5, 10)
+
+
+def _fake_stateless(calls_made, reply):
+    async def fake(prompt, flow, tool_calls=None):
+        tool_calls.extend(calls_made)
+        return reply
+    return fake
+
+
+def test_play_music_trusts_tool_result_not_llm_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(pa, "MUSIC_CACHE", pa.MusicQueryCache(str(tmp_path / "m.json"), 10, 3600))
+    arguments = {"song_name": "晴天", "artist_name": "周杰倫"}
+
+    # LLM 聲稱成功，但 play_song 實際只找到結果、沒有開啟播放器
+    failed = [{"id": "c1", "name": "play_song", "arguments": arguments, "result": "Found: 晴天\n無法自動開啟 Chrome。"}]
+    monkeypatch.setattr(pa, "tool_call_stateless", _fake_stateless(failed, '{"status": "ok"}'))
+    assert asyncio.run(pa.play_music(None, "周杰倫 晴天")) is False
+    assert pa.MUSIC_CACHE.get("周杰倫 晴天") is None
+
+    played = [{"id": "c2", "name": "play_song", "arguments": arguments, "result": "Playing top result: 晴天"}]
+    monkeypatch.setattr(pa, "tool_call_stateless", _fake_stateless(played, "好的，為你播放。"))
+    assert asyncio.run(pa.play_music(None, "周杰倫 晴天")) is True
+    assert pa.MUSIC_CACHE.get("周杰倫 晴天") == arguments
+
+
+def test_open_ended_music_queries_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(pa, "MUSIC_CACHE", pa.MusicQueryCache(str(tmp_path / "m.json"), 10, 3600))
+    played = [{"id": "c1", "name": "play_song", "arguments": {"song_name": "lofi mix"},
+               "result": "Playing top result: lofi mix"}]
+    monkeypatch.setattr(pa, "tool_call_stateless", _fake_stateless(played, ""))
+    for query in ("隨便", "來點音樂", "想聽放鬆的鋼琴", "lo-fi", "play something"):
+        assert asyncio.run(pa.play_music(None, query)) is True
+    assert not pa.MUSIC_CACHE.entries
+    assert pa._music_query_is_specific("想聽五月天")
+
+
+def test_capture_attaches_tool_results_to_calls():
+    stream = [
+        {"choices": [{"delta": {"tool_calls": [
+            {"index": 0, "id": "c1", "function": {"name": "play_song", "arguments": '{"song_'}}]}}]},
+        {"choices": [{"delta": {"tool_calls": [
+            {"index": 0, "function": {"arguments": 'name": "晴天"}'}}]}}]},
+        {"role": "tool", "tool_call_id": "c1", "name": "play_song", "content": "Playing top result: 晴天"},
+        {"choices": [{"delta": {"content": "已播放"}}]},
+    ]
+
+    class FakeAgent:
+        async def run(self, text):
+            for item in stream:
+                yield item
+
+    calls = []
+    text = asyncio.run(pa.run_agent_and_capture(FakeAgent(), "play", calls))
+    assert text == "已播放"
+    assert calls == [{"id": "c1", "name": "play_song", "arguments": {"song_name": "晴天"},
+                      "result": "Playing top result: 晴天"}]
+
+
+def test_framed_stdout_keeps_frames_whole_across_threads(monkeypatch):
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # 讓執行緒頻繁切換，放大競態
+    out = io.StringIO()
+    monkeypatch.setattr(pa, "_FRAME_OUT", out)
+    framed = pa._FramedStdout()
+
+    def writer(tag):
+        for i in range(2000):
+            framed.write(f"{tag}-")
+            framed.write(f"{i}\n")
+            framed.flush()
+
+    threads = [threading.Thread(target=writer, args=(tag,)) for tag in "abcd"]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(old_interval)
+
+    frames = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert all(frame["type"] == "text" for frame in frames)
+    texts = "".join(frame["text"] for frame in frames)
+    for tag in "abcd":
+        assert texts.count(f"{tag}-") == 2000
+
+
+class FakeSlot:
+    """代替 _PooledAgent：不啟動 MCP 伺服器，記錄開啟次數與健康狀態。"""
+    opened = []
+
+    def __init__(self, cfg, prompt, on_load):
+        self.agent = object()
+        self.broken = False
+        self.alive = True
+        self.checked = False
+
+    async def open(self):
+        FakeSlot.opened.append(self)
+        await asyncio.sleep(0.05)  # 模擬啟動 MCP 伺服器
+
+    async def healthy(self):
+        return self.alive and not self.broken
+
+    def suspect(self):
+        self.checked = True
+
+    def reset(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def _fake_pool(monkeypatch, size):
+    FakeSlot.opened = []
+    monkeypatch.setattr(pa, "_PooledAgent", FakeSlot)
+    return pa.StatelessAgentPool({"model": "m", "servers": []}, size=size)
+
+
+def test_pool_never_grows_past_size_under_concurrent_borrows(monkeypatch):
+    async def scenario():
+        pool = _fake_pool(monkeypatch, size=2)
+        in_use = []
+
+        async def use():
+            async with pool.borrow() as agent:
+                in_use.append(agent)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(use() for _ in range(6)))
+        await pool.close()
+        return in_use
+
+    in_use = asyncio.run(scenario())
+    assert len(in_use) == 6
+    assert len(FakeSlot.opened) == 2
+
+
+def test_failed_borrow_does_not_strand_waiters(monkeypatch):
+    async def scenario():
+        pool = _fake_pool(monkeypatch, size=1)
+
+        async def failing():
+            async with pool.borrow():
+                await asyncio.sleep(0.02)
+                FakeSlot.opened[0].alive = False  # MCP 連線在使用中斷掉
+                raise ConnectionError("session closed")
+
+        async def waiting():
+            await asyncio.sleep(0.01)  # 等第一個借用者拿走唯一的 Agent 後才來排隊
+            async with pool.borrow() as agent:
+                return agent
+
+        results = await asyncio.wait_for(asyncio.gather(failing(), waiting(), return_exceptions=True), 2)
+        await pool.close()
+        return results
+
+    failed, agent = asyncio.run(scenario())
+    assert isinstance(failed, ConnectionError)
+    assert agent is FakeSlot.opened[1].agent  # 等待者拿到重建的 Agent，沒有卡住
+    assert len(FakeSlot.opened) == 2
+
+
+def test_tool_level_errors_keep_a_healthy_agent(monkeypatch):
+    async def scenario():
+        pool = _fake_pool(monkeypatch, size=1)
+        with contextlib.suppress(RuntimeError):
+            async with pool.borrow():
+                raise RuntimeError("找不到 MCP 工具：nope")
+        async with pool.borrow() as agent:
+            pass
+        await pool.close()
+        return agent
+
+    agent = asyncio.run(scenario())
+    assert len(FakeSlot.opened) == 1  # ping 通過就沿用，不重啟流程的 MCP 伺服器
+    assert agent is FakeSlot.opened[0].agent
+    assert FakeSlot.opened[0].checked
+
+
+def test_mind_search_falls_through_when_nothing_opened(monkeypatch):
+    replies = {
+        "自然": {"results": [{"name": "自在女聲.mp3", "score": 0.15}], "opened": None},
+        "溫柔": {"results": [{"name": "溫柔女聲.mp3", "score": 1.0}], "opened": "/media/溫柔女聲.mp3"},
+    }
+
+    async def fake_call(tool_name, arguments=None, flow="chat", pool=None):
+        assert (tool_name, arguments["open_best"]) == ("search_media", True)
+        return replies[arguments["query"]]
+
+    monkeypatch.setattr(pa, "call_tool_direct", fake_call)
+    assert asyncio.run(pa._mind_search_and_open("自然")) is None
+    assert asyncio.run(pa._mind_search_and_open("溫柔")) is True
+
+
+def test_chat_loop_closes_tool_pools_on_eof(monkeypatch):
+    closed = []
+
+    async def eof(prompt):
+        raise EOFError
+
+    async def watcher(queue):
+        await asyncio.Event().wait()
+
+    async def fake_close():
+        closed.append(True)
+
+    monkeypatch.setattr(pa, "ainput", eof)
+    monkeypatch.setattr(pa, "EMOTION_PUSH", False)
+    monkeypatch.setattr(pa, "emotion_watcher", watcher)
+    monkeypatch.setattr(pa, "_fast_boot_agent_class", lambda: None)
+    monkeypatch.setattr(pa, "close_tool_pool", fake_close)
+
+    with contextlib.suppress(EOFError):
+        asyncio.run(pa.chat_loop({"model": "m", "servers": []}))
+    assert closed == [True]
+
+
+def test_chat_loop_reports_failed_agent_preload(monkeypatch, capsys):
+    async def eof(prompt):
+        await asyncio.sleep(0.1)
+        raise EOFError
+
+    async def watcher(queue):
+        await asyncio.Event().wait()
+
+    async def fake_close():
+        pass
+
+    def missing_hub():
+        raise ImportError("No module named 'huggingface_hub'")
+
+    monkeypatch.setattr(pa, "ainput", eof)
+    monkeypatch.setattr(pa, "EMOTION_PUSH", False)
+    monkeypatch.setattr(pa, "emotion_watcher", watcher)
+    monkeypatch.setattr(pa, "_fast_boot_agent_class", missing_hub)
+    monkeypatch.setattr(pa, "close_tool_pool", fake_close)
+
+    with contextlib.suppress(EOFError):
+        asyncio.run(pa.chat_loop({"model": "m", "servers": []}))
+    assert "huggingface_hub" in capsys.readouterr().out